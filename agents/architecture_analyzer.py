@@ -3,59 +3,137 @@ AI Agent 1: Architecture Analyzer
 Analyzes Azure architecture diagrams and extracts components, relationships, and configurations
 """
 
-import json
+import asyncio
 import re
+from collections import Counter
 from typing import Dict, List, Any
 import openai
 import os
+import threading
 from dotenv import load_dotenv
 import hashlib
+from utils.fast_json import extract_json_span, json_dumps_bytes, json_loads, JSONDecodeError
 
 load_dotenv()
 
-class ArchitectureAnalyzer:
-    def __init__(self):
-        # Check if Azure AI Foundry configuration is available
-        self.azure_endpoint = os.getenv('AZURE_AI_AGENT1_ENDPOINT')
-        self.azure_key = os.getenv('AZURE_AI_AGENT1_KEY')
-        self.azure_deployment = os.getenv('AZURE_AI_AGENT1_DEPLOYMENT', 'gpt-4')
+# Timeout configuration for faster responses
+API_TIMEOUT = 30  # Reduced from default 60 seconds
+MAX_RETRIES = 2   # Reduced retries for faster failure
+
+# Compiled once; used to pull the JSON object out of model responses
+_JSON_SPAN_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Keyword tables for _fallback_validation
+# Azure service keywords (more comprehensive)
+AZURE_KEYWORDS = (
+    'azure', 'microsoft', 'app service', 'virtual machine', 'vm', 'storage account',
+    'sql database', 'cosmos db', 'key vault', 'application gateway', 'load balancer',
+    'virtual network', 'subnet', 'resource group', 'subscription', 'tenant',
+    'azure functions', 'service bus', 'event hubs', 'azure active directory',
+    'azure sql', 'azure storage', 'azure blob', 'azure table', 'azure queue',
+    'azure kubernetes service', 'aks', 'azure container', 'azure app service',
+    'azure web app', 'azure logic apps', 'azure data factory', 'azure synapse',
+    'azure devops', 'azure pipelines', 'azure boards', 'azure repos',
+    'azure monitor', 'azure security center', 'azure sentinel', 'azure firewall',
+    'azure front door', 'azure cdn', 'azure traffic manager', 'azure dns',
+    'azure backup', 'azure site recovery', 'azure migrate', 'azure arc'
+)
+
+# Non-Azure cloud keywords (more comprehensive)
+NON_AZURE_KEYWORDS = (
+    'aws', 'amazon', 'ec2', 's3', 'lambda', 'rds', 'dynamo', 'cloudfront',
+    'route53', 'elb', 'alb', 'nlb', 'vpc', 'api gateway', 'cloudwatch',
+    'cloudtrail', 'cloudformation', 'elastic beanstalk', 'ecs', 'eks',
+    'fargate', 'sqs', 'sns', 'kinesis', 'redshift', 'athena', 'glue',
+    'google cloud', 'gcp', 'compute engine', 'cloud storage', 'big query',
+    'cloud functions', 'cloud run', 'gke', 'cloud sql', 'firebase',
+    'oracle cloud', 'oci', 'heroku', 'digitalocean', 'alibaba cloud',
+    'linode', 'vultr', 'ibm cloud', 'salesforce', 'snowflake'
+)
+
+# AWS/GCP-specific patterns that are strong indicators (subsets of NON_AZURE_KEYWORDS)
+AWS_STRONG_INDICATORS = ('ec2', 's3', 'lambda', 'rds', 'dynamo', 'cloudfront', 'route53')
+GCP_STRONG_INDICATORS = ('compute engine', 'cloud storage', 'big query', 'cloud functions')
+
+def _bucket_by_first_char(keywords):
+    """Group keywords by their first character so absent characters prune whole buckets"""
+    buckets = {}
+    for keyword in keywords:
+        buckets.setdefault(keyword[0], []).append(keyword)
+    return buckets
+
+_AZURE_BY_FIRST = _bucket_by_first_char(AZURE_KEYWORDS)
+_NON_AZURE_BY_FIRST = _bucket_by_first_char(NON_AZURE_KEYWORDS)
+
+# Shared OpenAI client so all analyzer instances reuse one HTTP connection pool
+_CLIENT = None
+_MODEL = None
+_client_lock = threading.Lock()
+
+def _get_client():
+    """Return the process-wide OpenAI client and model name, creating them on first use"""
+    global _CLIENT, _MODEL
+    if _CLIENT is not None:
+        return _CLIENT, _MODEL
+    
+    with _client_lock:
+        if _CLIENT is not None:
+            return _CLIENT, _MODEL
         
-        # Timeout configuration for faster responses
-        self.api_timeout = 30  # Reduced from default 60 seconds
-        self.max_retries = 2   # Reduced retries for faster failure
+        # Check if Azure AI Foundry configuration is available
+        azure_endpoint = os.getenv('AZURE_AI_AGENT1_ENDPOINT')
+        azure_key = os.getenv('AZURE_AI_AGENT1_KEY')
+        azure_deployment = os.getenv('AZURE_AI_AGENT1_DEPLOYMENT', 'gpt-4')
         
-        if self.azure_endpoint and self.azure_key:
+        if azure_endpoint and azure_key:
             # Extract base endpoint from full URL
-            base_endpoint = self.azure_endpoint.split('/openai/deployments')[0]
+            base_endpoint = azure_endpoint.split('/openai/deployments')[0]
             
             # Extract deployment name from endpoint URL 
-            if '/openai/deployments/' in self.azure_endpoint:
-                deployment_name = self.azure_endpoint.split('/openai/deployments/')[1].split('/')[0]
+            if '/openai/deployments/' in azure_endpoint:
+                deployment_name = azure_endpoint.split('/openai/deployments/')[1].split('/')[0]
             else:
-                deployment_name = self.azure_deployment
+                deployment_name = azure_deployment
             
             # Use Azure AI Foundry endpoint with timeout
-            self.openai_client = openai.AzureOpenAI(
+            client = openai.AzureOpenAI(
                 azure_endpoint=base_endpoint,
-                api_key=self.azure_key,
+                api_key=azure_key,
                 api_version="2024-10-21",  # Updated API version
-                timeout=self.api_timeout,
-                max_retries=self.max_retries
+                timeout=API_TIMEOUT,
+                max_retries=MAX_RETRIES
             )
-            self.model_name = deployment_name
+            _MODEL = deployment_name
             print(f"✅ Architecture Analyzer: Using Azure AI Foundry endpoint: {base_endpoint}")
             print(f"🎯 Using deployment: {deployment_name}")
-            print(f"⚡ Timeout: {self.api_timeout}s, Max retries: {self.max_retries}")
+            print(f"⚡ Timeout: {API_TIMEOUT}s, Max retries: {MAX_RETRIES}")
         else:
             # Fallback to OpenAI with timeout
-            self.openai_client = openai.OpenAI(
+            client = openai.OpenAI(
                 api_key=os.getenv('OPENAI_API_KEY'),
-                timeout=self.api_timeout,
-                max_retries=self.max_retries
+                timeout=API_TIMEOUT,
+                max_retries=MAX_RETRIES
             )
-            self.model_name = "gpt-4"
+            _MODEL = "gpt-4"
             print(f"⚠️ Architecture Analyzer: Using OpenAI fallback (configure Azure AI Foundry for production)")
-            print(f"⚡ Timeout: {self.api_timeout}s, Max retries: {self.max_retries}")
+            print(f"⚡ Timeout: {API_TIMEOUT}s, Max retries: {MAX_RETRIES}")
+        
+        _CLIENT = client
+        return _CLIENT, _MODEL
+
+class ArchitectureAnalyzer:
+    def __init__(self):
+        # Check if Azure AI Foundry configuration is available
+        self.azure_endpoint = os.getenv('AZURE_AI_AGENT1_ENDPOINT')
+        self.azure_key = os.getenv('AZURE_AI_AGENT1_KEY')
+        self.azure_deployment = os.getenv('AZURE_AI_AGENT1_DEPLOYMENT', 'gpt-4')
+        
+        # Timeout configuration for faster responses
+        self.api_timeout = API_TIMEOUT
+        self.max_retries = MAX_RETRIES
+        
+        # Reuse the shared client instead of opening a new connection pool per instance
+        self.openai_client, self.model_name = _get_client()
         
         # Enhanced caching system
         self._cache = {}
@@ -205,11 +283,11 @@ class ArchitectureAnalyzer:
             metadata = content.get('metadata', {})
             filename = metadata.get('filename', '')
             
-            # Create hash from key components only
-            key_content = f"{text_content[:500]}{filename}"  # First 500 chars + filename
-            return hashlib.md5(key_content.encode()).hexdigest()
+            # Create hash from key components only: first 500 chars + filename
+            key_content = json_dumps_bytes([text_content[:500], filename])
         else:
-            return hashlib.md5(str(content)[:500].encode()).hexdigest()
+            key_content = json_dumps_bytes(str(content)[:500])
+        return hashlib.blake2b(key_content, digest_size=16).hexdigest()
     
     def _get_from_cache(self, cache_key):
         """Get cached result if available"""
@@ -677,7 +755,8 @@ class ArchitectureAnalyzer:
                     if hasattr(response, 'usage') and response.usage:
                         analysis_result['tokens_used'] = response.usage.total_tokens
                     else:
-                        analysis_result['tokens_used'] = len(analysis_prompt.split()) * 2
+                        # Roughly 4 characters per token for GPT tokenizers
+                        analysis_result['tokens_used'] = (len(analysis_prompt) + len(response.choices[0].message.content or '')) // 4
                     
                     analysis_result['processing_method'] = 'ai_enhanced'
                 else:
@@ -701,6 +780,13 @@ class ArchitectureAnalyzer:
                 'tokens_used': 0
             }
     
+    async def analyze_architecture_async(self, extracted_content: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Awaitable variant of analyze_architecture so callers can gather several diagrams
+        concurrently over the shared client's connection pool
+        """
+        return await asyncio.to_thread(self.analyze_architecture, extracted_content)
+    
     def _ai_validate_and_enhance(self, text_content: str, components: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Use AI to validate and enhance pattern-detected components"""
         
@@ -777,7 +863,8 @@ class ArchitectureAnalyzer:
                 if hasattr(response, 'usage') and response.usage:
                     result['tokens_used'] = response.usage.total_tokens
                 else:
-                    result['tokens_used'] = len(prompt.split()) * 2
+                    # Roughly 4 characters per token for GPT tokenizers
+                    result['tokens_used'] = (len(prompt) + len(response.choices[0].message.content or '')) // 4
                 
                 return result
             else:
@@ -851,7 +938,8 @@ class ArchitectureAnalyzer:
                 if hasattr(response, 'usage') and response.usage:
                     result['tokens_used'] = response.usage.total_tokens
                 else:
-                    result['tokens_used'] = len(prompt.split()) * 2
+                    # Roughly 4 characters per token for GPT tokenizers
+                    result['tokens_used'] = (len(prompt) + len(response.choices[0].message.content or '')) // 4
                 
                 return result
             else:
@@ -983,15 +1071,15 @@ class ArchitectureAnalyzer:
         """Parse the OpenAI response into structured format with enhanced accuracy"""
         try:
             # Try to extract JSON from the response
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
+            json_match = _JSON_SPAN_RE.search(response)
             if json_match:
-                result = json.loads(json_match.group())
+                result = json_loads(json_match.group())
                 # Post-process to improve accuracy
                 return self._post_process_analysis(result)
             else:
                 # Fallback parsing if JSON not found
                 return self._fallback_parse(response)
-        except json.JSONDecodeError:
+        except JSONDecodeError:
             return self._fallback_parse(response)
     
     def _select_optimal_model(self, content: Dict[str, Any]) -> str:
@@ -1364,29 +1452,25 @@ class ArchitectureAnalyzer:
         """Generate a summary of analyzed components"""
         components = analysis.get('components', [])
         
-        summary = {
-            'total_components': len(components),
-            'service_types': {},
-            'regions': set(),
-            'dependencies_count': 0
-        }
+        service_types = Counter()
+        regions = {}  # dict keeps first-seen order and deduplicates
+        dependencies_count = 0
         
         for component in components:
-            service_type = component.get('type', 'unknown')
-            if service_type in summary['service_types']:
-                summary['service_types'][service_type] += 1
-            else:
-                summary['service_types'][service_type] = 1
+            service_types[component.get('type', 'unknown')] += 1
             
-            region = component.get('configuration', {}).get('region')
+            region = (component.get('configuration') or {}).get('region')
             if region:
-                summary['regions'].add(region)
+                regions[region] = None
             
-            dependencies = component.get('dependencies', [])
-            summary['dependencies_count'] += len(dependencies)
+            dependencies_count += len(component.get('dependencies') or ())
         
-        summary['regions'] = list(summary['regions'])
-        return summary
+        return {
+            'total_components': len(components),
+            'service_types': dict(service_types),
+            'regions': list(regions),
+            'dependencies_count': dependencies_count
+        }
     
     def _validate_azure_architecture(self, extracted_content: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -1419,14 +1503,13 @@ class ArchitectureAnalyzer:
                     'oracle cloud', 'oci', 'heroku', 'digitalocean'
                 ]
                 
-                # Check filename and available text
-                all_text = f"{image_text} {filename}".lower()
-                
+                # Check filename and available text separately (filename first - it is
+                # short and the most likely place for a platform hint)
                 # Also check if the filename explicitly mentions AWS or other platforms
                 detected_platforms = []
                 
                 for indicator in strong_non_azure_indicators:
-                    if indicator in all_text:
+                    if indicator in filename or indicator in image_text:
                         platform_name = {
                             'aws': 'AWS',
                             'amazon': 'AWS',
@@ -1459,7 +1542,7 @@ class ArchitectureAnalyzer:
                 
                 # Check if filename contains Azure indicators
                 azure_indicators = ['azure', 'microsoft', 'az-', 'azure-']
-                azure_found = any(indicator in all_text for indicator in azure_indicators)
+                azure_found = any(indicator in filename or indicator in image_text for indicator in azure_indicators)
                 
                 if azure_found:
                     print(f"✅ Image file with Azure indicators detected. Proceeding with analysis...")
@@ -1541,84 +1624,66 @@ class ArchitectureAnalyzer:
     
     def _parse_validation_response(self, response: str) -> Dict[str, Any]:
         """Parse the validation response from OpenAI"""
-        try:
-            # Extract JSON from response
-            import re
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-            else:
-                # Fallback: analyze text content for cloud services
-                return self._fallback_validation(response)
-        except json.JSONDecodeError:
-            return self._fallback_validation(response)
+        # Extract the JSON object, which the model may surround with prose
+        json_span = extract_json_span(response or '')
+        if json_span:
+            try:
+                return json_loads(response[json_span[0]:json_span[1]])
+            except JSONDecodeError:
+                pass
+        # Fallback: analyze text content for cloud services
+        return self._fallback_validation(response or '')
     
     def _fallback_validation(self, response: str) -> Dict[str, Any]:
         """Fallback validation using keyword matching"""
         response_lower = response.lower()
         
-        # Azure service keywords (more comprehensive)
-        azure_keywords = [
-            'azure', 'microsoft', 'app service', 'virtual machine', 'vm', 'storage account',
-            'sql database', 'cosmos db', 'key vault', 'application gateway', 'load balancer',
-            'virtual network', 'subnet', 'resource group', 'subscription', 'tenant',
-            'azure functions', 'service bus', 'event hubs', 'azure active directory',
-            'azure sql', 'azure storage', 'azure blob', 'azure table', 'azure queue',
-            'azure kubernetes service', 'aks', 'azure container', 'azure app service',
-            'azure web app', 'azure logic apps', 'azure data factory', 'azure synapse',
-            'azure devops', 'azure pipelines', 'azure boards', 'azure repos',
-            'azure monitor', 'azure security center', 'azure sentinel', 'azure firewall',
-            'azure front door', 'azure cdn', 'azure traffic manager', 'azure dns',
-            'azure backup', 'azure site recovery', 'azure migrate', 'azure arc'
-        ]
-        
-        # Non-Azure cloud keywords (more comprehensive)
-        non_azure_keywords = [
-            'aws', 'amazon', 'ec2', 's3', 'lambda', 'rds', 'dynamo', 'cloudfront',
-            'route53', 'elb', 'alb', 'nlb', 'vpc', 'api gateway', 'cloudwatch',
-            'cloudtrail', 'cloudformation', 'elastic beanstalk', 'ecs', 'eks',
-            'fargate', 'sqs', 'sns', 'kinesis', 'redshift', 'athena', 'glue',
-            'google cloud', 'gcp', 'compute engine', 'cloud storage', 'big query',
-            'cloud functions', 'cloud run', 'gke', 'cloud sql', 'firebase',
-            'oracle cloud', 'oci', 'heroku', 'digitalocean', 'alibaba cloud',
-            'linode', 'vultr', 'ibm cloud', 'salesforce', 'snowflake'
-        ]
-        
-        # AWS-specific patterns that are strong indicators
-        aws_strong_indicators = ['ec2', 's3', 'lambda', 'rds', 'dynamo', 'cloudfront', 'route53']
-        gcp_strong_indicators = ['compute engine', 'cloud storage', 'big query', 'cloud functions']
+        # Only substring-test keywords whose first character occurs in the text;
+        # every later check reads from these hits
+        present = set(response_lower)
+        azure_hits = {
+            keyword
+            for first, bucket in _AZURE_BY_FIRST.items() if first in present
+            for keyword in bucket if keyword in response_lower
+        }
+        non_azure_hits = {
+            keyword
+            for first, bucket in _NON_AZURE_BY_FIRST.items() if first in present
+            for keyword in bucket if keyword in response_lower
+        }
         
-        azure_count = sum(1 for keyword in azure_keywords if keyword in response_lower)
-        non_azure_count = sum(1 for keyword in non_azure_keywords if keyword in response_lower)
+        # Strong indicators are a subset of the non-Azure keywords, so no rescan is needed
+        aws_strong_hits = [keyword for keyword in AWS_STRONG_INDICATORS if keyword in non_azure_hits]
+        gcp_strong_hits = [keyword for keyword in GCP_STRONG_INDICATORS if keyword in non_azure_hits]
         
-        # Check for strong AWS indicators
-        aws_strong_count = sum(1 for keyword in aws_strong_indicators if keyword in response_lower)
-        gcp_strong_count = sum(1 for keyword in gcp_strong_indicators if keyword in response_lower)
+        azure_count = len(azure_hits)
+        non_azure_count = len(non_azure_hits)
         
         # If we find strong AWS/GCP indicators, it's definitely not Azure
-        if aws_strong_count > 0 or gcp_strong_count > 0:
-            is_azure = False
+        strong_non_azure = bool(aws_strong_hits or gcp_strong_hits)
+        is_azure = not strong_non_azure and azure_count > non_azure_count and azure_count > 0
+        if strong_non_azure:
             confidence = 0.9  # High confidence it's not Azure
         else:
-            is_azure = azure_count > non_azure_count and azure_count > 0
-            confidence = min(azure_count / max(azure_count + non_azure_count, 1), 1.0)
+            total = azure_count + non_azure_count
+            confidence = azure_count / total if total else 0.0
         
         detected_platforms = []
         non_azure_services = []
         
         if azure_count > 0:
             detected_platforms.append('Azure')
-        if 'aws' in response_lower or any(keyword in response_lower for keyword in aws_strong_indicators):
+        if 'aws' in non_azure_hits or aws_strong_hits:
             detected_platforms.append('AWS')
-            non_azure_services.extend([kw for kw in aws_strong_indicators if kw in response_lower])
-        if 'google cloud' in response_lower or 'gcp' in response_lower or gcp_strong_count > 0:
+            non_azure_services.extend(aws_strong_hits)
+        if 'google cloud' in non_azure_hits or 'gcp' in non_azure_hits or gcp_strong_hits:
             detected_platforms.append('Google Cloud')
-            non_azure_services.extend([kw for kw in gcp_strong_indicators if kw in response_lower])
+            non_azure_services.extend(gcp_strong_hits)
         
         return {
             'is_azure_architecture': is_azure,
             'confidence_score': confidence,
-            'azure_services_found': [kw for kw in azure_keywords if kw in response_lower],
+            'azure_services_found': [keyword for keyword in AZURE_KEYWORDS if keyword in azure_hits],
             'non_azure_services_found': non_azure_services,
             'detected_platforms': detected_platforms,
             'primary_platform': 'Azure' if is_azure else (detected_platforms[0] if detected_platforms else 'Unknown')
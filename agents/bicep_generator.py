@@ -3,110 +3,95 @@ AI Agent 3: Bicep Generator
 Generates Azure Bicep templates and YAML pipelines based on architecture analysis and compliance checks
 """
 
-import json
+import collections
+import concurrent.futures
+import functools
+from datetime import datetime
+import logging
 import os
-from typing import Dict, List, Any, Optional
+import threading
+from types import MappingProxyType
+from typing import Dict, List, Any, Mapping, Optional
+import httpx
+import jinja2
 import openai
 from dotenv import load_dotenv
 import hashlib
+from utils.disk_cache import DiskLRUCache
+from utils.model_capabilities import supports_json_object, supports_json_schema
+from utils.fast_json import collect_streamed_response, extract_json_span, json_dumps, json_dumps_bytes, json_loads, JSONDecodeError
+
+# xxh3 is several times faster than blake2b on small inputs; both are stable
+# across processes, which the disk cache keys rely on
+try:
+    import xxhash
+    _new_cache_key_hasher = xxhash.xxh3_64
+except ImportError:
+    _new_cache_key_hasher = functools.partial(hashlib.blake2b, digest_size=8)
 
 load_dotenv()
 
-class BicepGenerator:
-    def __init__(self):
-        # Check if Azure AI Foundry configuration is available
-        self.azure_endpoint = os.getenv('AZURE_AI_AGENT4_ENDPOINT')
-        self.azure_key = os.getenv('AZURE_AI_AGENT4_KEY')
-        self.azure_deployment = os.getenv('AZURE_AI_AGENT4_DEPLOYMENT', 'gpt-4')
-        
-        if self.azure_endpoint and self.azure_key:
-            # Use Azure AI Foundry endpoint
-            self.openai_client = openai.AzureOpenAI(
-                azure_endpoint=self.azure_endpoint,
-                api_key=self.azure_key,
-                api_version="2024-02-01"
-            )
-            self.model_name = self.azure_deployment
-            print(f"✅ Bicep Generator: Using Azure AI Foundry endpoint")
-        else:
-            # Fallback to OpenAI
-            self.openai_client = openai.OpenAI(
-                api_key=os.getenv('OPENAI_API_KEY')
-            )
-            self.model_name = "gpt-4"
-            print(f"⚠️ Bicep Generator: Using OpenAI fallback (configure Azure AI Foundry for production)")
-        
-        # Load Bicep templates
-        self.bicep_templates = self._load_bicep_templates()
-        
-        # Template cache for faster generation
-        self._template_cache = {}
-        self._max_cache_size = 30
-    
-    def generate_bicep_templates(self, architecture_analysis: Dict[str, Any], policy_compliance: Dict[str, Any], cost_optimization: Dict[str, Any] = None, environment: str = 'dev') -> Dict[str, Any]:
-        """
-        Generate Bicep templates with cost optimization considerations
-        """
-        
-        # Check cache first
-        cache_key = self._get_cache_key(architecture_analysis, policy_compliance, cost_optimization, environment)
-        cached_result = self._get_from_cache(cache_key)
-        if cached_result:
-            print("🏗️ Bicep Generator: Using cached templates")
-            return cached_result
-        
-        try:
-            # Create generation prompt with cost optimization
-            generation_prompt = self._create_generation_prompt(
-                architecture_analysis,
-                policy_compliance,
-                cost_optimization,
-                environment
-            )
-            
-            # Call OpenAI API for Bicep generation
-            response = self.openai_client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert Azure DevOps engineer and Bicep template specialist. Generate production-ready Bicep templates and Azure DevOps YAML pipelines."
-                    },
-                    {
-                        "role": "user",
-                        "content": generation_prompt
-                    }
-                ],
-                temperature=0.1,
-                timeout=300  # 5 minutes timeout for OpenAI API
-            )
-            
-            # Parse generation results
-            generation_result = self._parse_generation_response(
-                response.choices[0].message.content,
-                architecture_analysis,
-                policy_compliance,
-                cost_optimization,
-                environment
-            )
-            
-            # Save to cache
-            self._save_to_cache(cache_key, generation_result)
-            
-            return generation_result
-            
-        except Exception as e:
-            return {
-                'error': f'Bicep generation failed: {str(e)}',
-                'bicep_templates': {},
-                'yaml_pipelines': {},
-                'documentation': {}
-            }
-    
-    def _load_bicep_templates(self) -> Dict[str, str]:
-        """Load Bicep template snippets"""
-        return {
-            'resource_group': """
+# Setup logger
+logger = logging.getLogger(__name__)
+
+# Static prompt content kept byte-identical across requests so OpenAI/Azure
+# automatic prompt caching can match the prefix
+GENERATION_SYSTEM_PROMPT = """You are an expert Azure DevOps engineer and Bicep template specialist. Generate production-ready Bicep templates and Azure DevOps YAML pipelines.
+
+Always respond with a single JSON object in this shape, replacing <environment> with the target environment name:
+{
+    "bicep_templates": {
+        "main.bicep": "template content with cost optimizations",
+        "parameters/": {"<environment>.parameters.json": "optimized params"}
+    },
+    "yaml_pipelines": {
+        "azure-pipelines-<environment>.yml": "pipeline content"
+    },
+    "scripts": {
+        "deploy-<environment>.ps1": "deploy script"
+    }
+}"""
+
+# Result of the disabled optimize_architecture_costs stub, shared read-only
+_EMPTY_COST_RESULT = MappingProxyType({
+    'applied_optimizations': (),
+    'cost_savings_estimate': 0,
+    'optimized_components': (),
+    'recommendations': ()
+})
+
+# Structured-output schema for the generation call. File names depend on the
+# environment, so the maps are open-keyed and strict mode (which requires every
+# key to be declared) is left off.
+_FILE_MAP_SCHEMA = {"type": "object", "additionalProperties": {"type": "string"}}
+BICEP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "bicep_templates": {
+            "type": "object",
+            "additionalProperties": {"anyOf": [{"type": "string"}, _FILE_MAP_SCHEMA]}
+        },
+        "yaml_pipelines": _FILE_MAP_SCHEMA,
+        "scripts": _FILE_MAP_SCHEMA
+    },
+    "required": ["bicep_templates", "yaml_pipelines", "scripts"]
+}
+
+GENERATION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "bicep_output", "schema": BICEP_SCHEMA, "strict": False}
+}
+
+GENERATION_INSTRUCTIONS = """Generate Azure Bicep templates and a DevOps pipeline for the environment below with cost optimization.
+
+IMPORTANT: Implement cost optimizations from bicep_generation_hints in the templates.
+Include conditional deployments, environment-specific SKUs, and auto-shutdown for dev environments.
+Match the pipeline to the stated pipeline complexity and keep a cost optimization focus.
+"""
+
+# Bicep template snippets, built once at import time (read-only)
+BICEP_TEMPLATES = MappingProxyType({
+    'resource_group': """
 @description('Name of the resource group')
 param resourceGroupName string = 'rg-${uniqueString(subscription().id)}'
 
@@ -123,7 +108,7 @@ param tags object = {
   Project: 'Infrastructure'
 }
 """,
-            'storage_account': """
+    'storage_account': """
 @description('Storage account name')
 param storageAccountName string = 'st${uniqueString(resourceGroup().id)}'
 
@@ -154,7 +139,7 @@ resource storageAccount 'Microsoft.Storage/storageAccounts@2023-01-01' = {
   }
 }
 """,
-            'app_service': """
+    'app_service': """
 @description('App Service plan name')
 param appServicePlanName string = 'asp-${uniqueString(resourceGroup().id)}'
 
@@ -188,7 +173,249 @@ resource appService 'Microsoft.Web/sites@2023-01-01' = {
   }
 }
 """
-        }
+})
+
+# Environment-specific requirements for template generation (read-only)
+ENVIRONMENT_REQUIREMENTS = MappingProxyType({
+    'development': {
+        'pipeline_complexity': 'simple',
+        'approval_gates': False,
+        'security_scans': 'basic',
+        'deployment_stages': ['validate', 'deploy'],
+        'sku_tier': 'basic',
+        'monitoring': 'basic',
+        'backup_required': False,
+        'multi_region': False
+    },
+    'staging': {
+        'pipeline_complexity': 'moderate',
+        'approval_gates': True,
+        'security_scans': 'standard',
+        'deployment_stages': ['validate', 'security-scan', 'deploy', 'test'],
+        'sku_tier': 'standard',
+        'monitoring': 'standard',
+        'backup_required': True,
+        'multi_region': False
+    },
+    'production': {
+        'pipeline_complexity': 'advanced',
+        'approval_gates': True,
+        'security_scans': 'comprehensive',
+        'deployment_stages': ['validate', 'security-scan', 'approval', 'deploy-staging', 'approval', 'deploy-production', 'smoke-test'],
+        'sku_tier': 'premium',
+        'monitoring': 'comprehensive',
+        'backup_required': True,
+        'multi_region': True
+    }
+})
+
+
+# One pooled HTTP client shared by every BicepGenerator so keep-alive
+# connections (and their TLS sessions) are reused across requests
+_HTTP_CLIENT = openai.DefaultHttpxClient(
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0),
+    timeout=300.0
+)
+
+@functools.lru_cache(maxsize=None)
+def _get_jinja_environment() -> jinja2.Environment:
+    """Jinja2 environment for the fallback documents, built once per process"""
+    # Bytecode cache sits in the project's .cache directory (not the working directory)
+    # unless BICEP_JINJA_CACHE_DIR points elsewhere
+    cache_dir = os.getenv(
+        'BICEP_JINJA_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'jinja')
+    )
+    bytecode_cache = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+    except OSError as e:
+        logger.warning(f"⚠️ Bicep Generator: Jinja bytecode cache disabled ({cache_dir}): {str(e)}")
+    
+    return jinja2.Environment(
+        loader=jinja2.PackageLoader('agents', 'templates'),
+        bytecode_cache=bytecode_cache,
+        auto_reload=False,
+        keep_trailing_newline=True
+    )
+
+class BicepGenerator:
+    # In-memory caches live on the class so every instance in the process shares
+    # them; _cache_lock guards their eviction
+    
+    # Template cache for faster generation (least recently used evicted first)
+    _template_cache = collections.OrderedDict()
+    _max_cache_size = 30
+    _cache_lock = threading.Lock()
+    
+    def __init__(self):
+        # Check if Azure AI Foundry configuration is available
+        self.azure_endpoint = os.getenv('AZURE_AI_AGENT4_ENDPOINT')
+        self.azure_key = os.getenv('AZURE_AI_AGENT4_KEY')
+        self.azure_deployment = os.getenv('AZURE_AI_AGENT4_DEPLOYMENT', 'gpt-4')
+        
+        # The OpenAI client is built on first use (see openai_client) so paths
+        # that never call the model skip the client setup
+        
+        # Load Bicep templates
+        self.bicep_templates = BICEP_TEMPLATES
+        
+        # Fallback documents are Jinja2 templates compiled once and kept in a bytecode cache
+        self._jinja = _get_jinja_environment()
+        
+        # Disk-backed LRU so previously generated templates survive restarts; it lives in the
+        # project's .cache directory (not the working directory) unless BICEP_CACHE_PATH is set
+        self._disk_cache = DiskLRUCache(
+            os.getenv(
+                'BICEP_CACHE_PATH',
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'bicep_templates.sqlite3')
+            ),
+            max_entries=500,
+            expire_seconds=86400
+        )
+    
+    @functools.cached_property
+    def openai_client(self):
+        """OpenAI client, constructed on first access"""
+        if self.azure_endpoint and self.azure_key:
+            # Use Azure AI Foundry endpoint
+            logger.info("✅ Bicep Generator: Using Azure AI Foundry endpoint")
+            return openai.AzureOpenAI(
+                azure_endpoint=self.azure_endpoint,
+                api_key=self.azure_key,
+                api_version="2024-10-21",  # first GA version with json_schema structured outputs
+                http_client=_HTTP_CLIENT
+            )
+        
+        # Fallback to OpenAI
+        logger.warning("⚠️ Bicep Generator: Using OpenAI fallback (configure Azure AI Foundry for production)")
+        return openai.OpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            http_client=_HTTP_CLIENT
+        )
+    
+    @functools.cached_property
+    def model_name(self) -> str:
+        """Deployment or model name matching openai_client"""
+        if self.azure_endpoint and self.azure_key:
+            return self.azure_deployment
+        return "gpt-4"
+    
+    @functools.cached_property
+    def response_format(self):
+        """Strictest response_format model_name accepts; plain gpt-4 rejects any with a 400"""
+        if supports_json_schema(self.model_name):
+            return GENERATION_RESPONSE_FORMAT
+        if supports_json_object(self.model_name):
+            return {"type": "json_object"}
+        return openai.NOT_GIVEN
+    
+    def generate_bicep_templates(self, architecture_analysis: Dict[str, Any], policy_compliance: Dict[str, Any], cost_optimization: Dict[str, Any] = None, environment: str = 'dev') -> Dict[str, Any]:
+        """
+        Generate Bicep templates with cost optimization considerations
+        """
+        
+        # The disabled cost stub carries no optimizations; treat it as absent so it
+        # skips key serialization and shares cache entries with plain requests
+        if cost_optimization is _EMPTY_COST_RESULT:
+            cost_optimization = None
+        
+        # Check cache first
+        cache_key = self._get_cache_key(architecture_analysis, policy_compliance, cost_optimization, environment)
+        cached_result = self._get_from_cache(cache_key)
+        if cached_result:
+            logger.debug("🏗️ Bicep Generator: Using cached templates")
+            return cached_result
+        
+        try:
+            # Create generation prompt with cost optimization
+            generation_prompt = self._create_generation_prompt(
+                architecture_analysis,
+                policy_compliance,
+                cost_optimization,
+                environment
+            )
+            
+            # Different input dicts can render the same prompt; reuse the generated files.
+            # Metadata is rebuilt from this request (compliance is not part of the prompt)
+            prompt_key = 'prompt-files:' + hashlib.blake2b(generation_prompt.encode(), digest_size=16).hexdigest()
+            cached_files = self._disk_cache.get(prompt_key)
+            if cached_files:
+                logger.debug("🏗️ Bicep Generator: Using templates cached for an identical prompt")
+                cached_result = dict(cached_files)
+                cached_result['metadata'] = self._build_generation_metadata(architecture_analysis, policy_compliance, cost_optimization, environment)
+                self._save_to_cache(cache_key, cached_result)
+                return cached_result
+            
+            # Call OpenAI API for Bicep generation
+            response = self.openai_client.chat.completions.create(
+                model=self.model_name,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": GENERATION_SYSTEM_PROMPT
+                    },
+                    {
+                        "role": "user",
+                        "content": generation_prompt
+                    }
+                ],
+                response_format=self.response_format,
+                temperature=0.0,  # deterministic output keeps the prompt cache correct
+                timeout=300,  # 5 minutes timeout for OpenAI API
+                stream=True
+            )
+            
+            # Parse generation results
+            generation_result = self._parse_generation_response(
+                collect_streamed_response(response),
+                architecture_analysis,
+                policy_compliance,
+                cost_optimization,
+                environment
+            )
+            
+            # Save to cache; fallback templates are not worth keeping, a later call may parse
+            if 'parsing_note' not in generation_result['metadata']:
+                self._save_to_cache(cache_key, generation_result)
+                self._disk_cache.set(prompt_key, {key: value for key, value in generation_result.items() if key != 'metadata'})
+            
+            return generation_result
+            
+        except Exception as e:
+            return {
+                'error': f'Bicep generation failed: {str(e)}',
+                'bicep_templates': {},
+                'yaml_pipelines': {},
+                'documentation': {}
+            }
+    
+    def generate_bicep_templates_batch(self, architecture_analysis: Dict[str, Any], policy_compliance: Dict[str, Any], cost_optimization: Dict[str, Any] = None, environments: List[str] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Generate Bicep templates for several environments concurrently.
+        Wall-clock time is the slowest environment instead of the sum of all of them.
+        """
+        environments = list(environments or ['development', 'staging', 'production'])
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(environments)) as executor:
+            future_to_env = {
+                executor.submit(
+                    self.generate_bicep_templates,
+                    architecture_analysis,
+                    policy_compliance,
+                    cost_optimization,
+                    environment
+                ): environment
+                for environment in environments
+            }
+            
+            results = {}
+            for future in concurrent.futures.as_completed(future_to_env):
+                results[future_to_env[future]] = future.result()
+        
+        # Preserve the requested environment order
+        return {environment: results[environment] for environment in environments}
     
     def generate_deployment_guide(self, templates: Dict[str, Any]) -> str:
         """Generate deployment guide"""
@@ -292,61 +519,77 @@ az group delete --name your-rg-name --yes --no-wait
 Cost Optimization Applied:
 - Framework: Microsoft Well-Architected Cost Optimization
 - Estimated Savings: {optimization_summary.get('estimated_monthly_savings', 'N/A')}
-- Bicep Hints: {json.dumps(bicep_hints, indent=1)}
+- Bicep Hints: {json_dumps(bicep_hints)}
 - Key Optimizations: {optimization_summary.get('key_optimization_areas', [])}
 """
         
-        prompt = f"""Generate Azure Bicep templates and DevOps pipeline for {environment.upper()} with cost optimization.
-
+        # Static instructions first so the provider can reuse the cached prompt prefix;
+        # everything request-specific goes at the end
+        prompt = f"""{GENERATION_INSTRUCTIONS}
 Environment: {environment}
-Requirements: {json.dumps(env_requirements, indent=1)}
+Pipeline complexity: {env_requirements.get('pipeline_complexity', 'simple')}
+Requirements: {json_dumps(env_requirements)}
 
 {cost_context}
 
-Architecture: {json.dumps(analysis, indent=1)}
-
-IMPORTANT: Implement cost optimizations from bicep_generation_hints in the templates.
-Include conditional deployments, environment-specific SKUs, and auto-shutdown for dev environments.
-
-Return JSON:
-{{
-    "bicep_templates": {{
-        "main.bicep": "template content with cost optimizations",
-        "parameters/": {{"{environment}.parameters.json": "optimized params"}}
-    }},
-    "yaml_pipelines": {{
-        "azure-pipelines-{environment}.yml": "pipeline content"
-    }},
-    "scripts": {{
-        "deploy-{environment}.ps1": "deploy script"
-    }}
-}}
-
-Make it {env_requirements.get('pipeline_complexity', 'simple')} for {environment} with cost optimization focus."""
+Architecture: {json_dumps(self._project_analysis_for_prompt(analysis))}"""
         
         return prompt
     
+    def _project_analysis_for_prompt(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Keep only the parts of the analysis that affect generated templates"""
+        return {
+            'components': [
+                {
+                    'name': component.get('name'),
+                    'type': component.get('type'),
+                    'configuration': component.get('configuration', {}),
+                    'dependencies': component.get('dependencies', [])
+                }
+                for component in analysis.get('components', [])
+            ],
+            'relationships': [
+                {
+                    'source': relationship.get('source'),
+                    'target': relationship.get('target'),
+                    'type': relationship.get('type')
+                }
+                for relationship in analysis.get('relationships', [])
+            ],
+            'network_topology': analysis.get('network_topology', {})
+        }
+    
     def _parse_generation_response(self, response: str, analysis: Dict[str, Any], compliance: Dict[str, Any], cost_optimization: Dict[str, Any] = None, environment: str = 'dev') -> Dict[str, Any]:
         """Parse the generation response with cost optimization metadata"""
         try:
-            # Try to extract JSON from the response
-            import re
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                generation_data = json.loads(json_match.group())
-                generation_data['metadata'] = {
-                    'generated_timestamp': self._get_timestamp(),
-                    'target_environment': environment,
-                    'source_analysis': analysis,
-                    'compliance_check': compliance,
-                    'cost_optimization_applied': bool(cost_optimization),
-                    'estimated_monthly_savings': cost_optimization.get('optimization_summary', {}).get('estimated_monthly_savings', 'N/A') if cost_optimization else 'N/A'
-                }
-                return generation_data
-            else:
+            # Structured output is bare JSON; decode it directly
+            generation_data = json_loads(response)
+        except JSONDecodeError:
+            generation_data = None
+        
+        if not isinstance(generation_data, dict):
+            # Deployments without json_schema support may still wrap the object in prose
+            json_span = extract_json_span(response)
+            if not json_span:
                 return self._fallback_generation_parse(response, analysis, compliance, cost_optimization, environment)
-        except json.JSONDecodeError:
-            return self._fallback_generation_parse(response, analysis, compliance, cost_optimization, environment)
+            try:
+                generation_data = json_loads(response[json_span[0]:json_span[1]])
+            except JSONDecodeError:
+                return self._fallback_generation_parse(response, analysis, compliance, cost_optimization, environment)
+        
+        generation_data['metadata'] = self._build_generation_metadata(analysis, compliance, cost_optimization, environment)
+        return generation_data
+    
+    def _build_generation_metadata(self, analysis: Dict[str, Any], compliance: Dict[str, Any], cost_optimization: Dict[str, Any] = None, environment: str = 'dev') -> Dict[str, Any]:
+        """Metadata describing the request a generation result was produced for"""
+        return {
+            'generated_timestamp': self._get_timestamp(),
+            'target_environment': environment,
+            'source_analysis': analysis,
+            'compliance_check': compliance,
+            'cost_optimization_applied': bool(cost_optimization),
+            'estimated_monthly_savings': cost_optimization.get('optimization_summary', {}).get('estimated_monthly_savings', 'N/A') if cost_optimization else 'N/A'
+        }
     
     def _fallback_generation_parse(self, response: str, analysis: Dict[str, Any], compliance: Dict[str, Any], cost_optimization: Dict[str, Any] = None, environment: str = 'dev') -> Dict[str, Any]:
         """Fallback parsing for generation response with cost optimization"""
@@ -364,12 +607,7 @@ Make it {env_requirements.get('pipeline_complexity', 'simple')} for {environment
                 f'deploy-{environment}.ps1': self._generate_fallback_deploy_script(environment)
             },
             'metadata': {
-                'generated_timestamp': self._get_timestamp(),
-                'target_environment': environment,
-                'source_analysis': analysis,
-                'compliance_check': compliance,
-                'cost_optimization_applied': bool(cost_optimization),
-                'estimated_monthly_savings': cost_optimization.get('optimization_summary', {}).get('estimated_monthly_savings', 'N/A') if cost_optimization else 'N/A',
+                **self._build_generation_metadata(analysis, compliance, cost_optimization, environment),
                 'parsing_note': 'Used fallback templates due to JSON parsing error'
             },
             'raw_response': response
@@ -387,7 +625,7 @@ Make it {env_requirements.get('pipeline_complexity', 'simple')} for {environment
         env_configs = bicep_hints.get('environment_configurations', {})
         cost_optimized = env_configs.get('cost_optimized', False)
         
-        bicep_content = f"""
+        parts = [f"""
 @description('Location for all resources')
 param location string = resourceGroup().location
 
@@ -405,479 +643,133 @@ param tags object = {{
   GeneratedFor: '{environment.title()}'
   CostOptimized: string(costOptimized)
 }}
-"""
+"""]
         
         # Add environment-specific parameters from cost optimization
         template_params = bicep_hints.get('template_parameters', {})
         for param_name, param_config in template_params.items():
             if param_config.get('environment_specific'):
-                bicep_content += f"\n@description('Cost optimized parameter for {param_name}')"
-                bicep_content += f"\nparam {param_name} string = '{param_config.get('default', 'Standard')}'"
+                parts.append(f"\n@description('Cost optimized parameter for {param_name}')")
+                parts.append(f"\nparam {param_name} string = '{param_config.get('default', 'Standard')}'")
         
         # Add auto-shutdown for development VMs
         if environment == 'development' and env_configs.get('auto_shutdown_enabled'):
-            bicep_content += """
+            parts.append("""
 
 @description('Auto-shutdown time for development VMs')
 param autoShutdownTime string = '19:00'
 
 @description('Auto-shutdown timezone')
 param autoShutdownTimeZone string = 'UTC'
-"""
+""")
         
         # Add basic resources based on detected components with cost optimization
+        storage_snippet = "\n// Storage Account with cost optimization\n" + self.bicep_templates['storage_account']
+        app_snippet = "\n// App Service with cost optimization\n" + self.bicep_templates['app_service']
+        snippet_by_type = {}  # resolve each distinct component type once
         for component in components:
             component_type = component.get('type', '').lower()
-            if 'storage' in component_type:
-                bicep_content += "\n// Storage Account with cost optimization\n" + self.bicep_templates['storage_account']
-            elif 'app' in component_type or 'web' in component_type:
-                bicep_content += "\n// App Service with cost optimization\n" + self.bicep_templates['app_service']
+            if component_type not in snippet_by_type:
+                if 'storage' in component_type:
+                    snippet_by_type[component_type] = storage_snippet
+                elif 'app' in component_type or 'web' in component_type:
+                    snippet_by_type[component_type] = app_snippet
+                else:
+                    snippet_by_type[component_type] = None
+            snippet = snippet_by_type[component_type]
+            if snippet:
+                parts.append(snippet)
         
         # Add conditional deployments from cost optimization
         conditional_deployments = bicep_hints.get('conditional_deployments', [])
         if conditional_deployments:
-            bicep_content += "\n\n// Conditional deployments for cost optimization"
+            parts.append("\n\n// Conditional deployments for cost optimization")
             for deployment in conditional_deployments:
                 condition = deployment.get('condition', '')
                 feature = deployment.get('feature', '')
-                bicep_content += f"\n// {feature} - {condition}"
+                parts.append(f"\n// {feature} - {condition}")
         
-        return bicep_content
+        return "".join(parts)
     
     def _generate_fallback_pipeline(self, environment: str) -> str:
         """Generate fallback Azure DevOps pipeline"""
         
-        # Environment-specific pipeline configuration
-        env_config = self._get_environment_requirements(environment)
-        
         if environment.lower() == 'production':
-            return f"""
-name: Azure-Infrastructure-{environment.title()}-$(Date:yyyyMMdd)$(Rev:.r)
-
-trigger:
-  branches:
-    include:
-    - main
-
-pool:
-  vmImage: 'ubuntu-latest'
-
-variables:
-  azureSubscription: 'Azure-{environment.title()}-Service-Connection'
-  resourceGroupName: 'rg-digitalsuperman-{environment}'
-  location: 'East US'
-  templatePath: 'bicep/main.bicep'
-  parametersPath: 'bicep/parameters/{environment}.parameters.json'
-
-stages:
-- stage: Validate
-  displayName: 'Validate Bicep Templates'
-  jobs:
-  - job: ValidateJob
-    displayName: 'Validate Templates'
-    steps:
-    - task: AzureCLI@2
-      displayName: 'Validate Bicep Template'
-      inputs:
-        azureSubscription: $(azureSubscription)
-        scriptType: 'bash'
-        scriptLocation: 'inlineScript'
-        inlineScript: |
-          az bicep build --file $(templatePath)
-          az deployment group validate \\
-            --resource-group $(resourceGroupName) \\
-            --template-file $(templatePath) \\
-            --parameters @$(parametersPath)
-
-- stage: SecurityScan
-  displayName: 'Security Scanning'
-  dependsOn: Validate
-  jobs:
-  - job: SecurityJob
-    displayName: 'Security Scan'
-    steps:
-    - task: AzureCLI@2
-      displayName: 'Security Scan Templates'
-      inputs:
-        azureSubscription: $(azureSubscription)
-        scriptType: 'bash'
-        scriptLocation: 'inlineScript'
-        inlineScript: |
-          echo "Running security scans..."
-          # Add your security scanning tools here
-
-- stage: ProductionApproval
-  displayName: 'Production Deployment Approval'
-  dependsOn: SecurityScan
-  jobs:
-  - deployment: ApprovalJob
-    displayName: 'Approve Production Deployment'
-    environment: 'production-approval'
-    strategy:
-      runOnce:
-        deploy:
-          steps:
-          - script: echo "Approved for production deployment"
-
-- stage: Deploy
-  displayName: 'Deploy to {environment.title()}'
-  dependsOn: ProductionApproval
-  jobs:
-  - deployment: DeployJob
-    displayName: 'Deploy Infrastructure'
-    environment: '{environment}'
-    strategy:
-      runOnce:
-        deploy:
-          steps:
-          - checkout: self
-          - task: AzureCLI@2
-            displayName: 'Deploy Infrastructure'
-            inputs:
-              azureSubscription: $(azureSubscription)
-              scriptType: 'bash'
-              scriptLocation: 'inlineScript'
-              inlineScript: |
-                az group create --name $(resourceGroupName) --location "$(location)"
-                az deployment group create \\
-                  --resource-group $(resourceGroupName) \\
-                  --template-file $(templatePath) \\
-                  --parameters @$(parametersPath) \\
-                  --verbose
-
-- stage: SmokeTest
-  displayName: 'Smoke Tests'
-  dependsOn: Deploy
-  jobs:
-  - job: SmokeTestJob
-    displayName: 'Run Smoke Tests'
-    steps:
-    - task: AzureCLI@2
-      displayName: 'Validate Deployment'
-      inputs:
-        azureSubscription: $(azureSubscription)
-        scriptType: 'bash'
-        scriptLocation: 'inlineScript'
-        inlineScript: |
-          echo "Running smoke tests..."
-          az resource list --resource-group $(resourceGroupName) --output table
-"""
+            template_name = 'pipeline_prod.yml.j2'
         else:
             # Development/Staging pipeline - simplified
-            return f"""
-name: Azure-Infrastructure-{environment.title()}-$(Date:yyyyMMdd)$(Rev:.r)
-
-trigger:
-  branches:
-    include:
-    - main
-    - develop
-
-pool:
-  vmImage: 'ubuntu-latest'
-
-variables:
-  azureSubscription: 'Azure-{environment.title()}-Service-Connection'
-  resourceGroupName: 'rg-digitalsuperman-{environment}'
-  location: 'East US'
-  templatePath: 'bicep/main.bicep'
-  parametersPath: 'bicep/parameters/{environment}.parameters.json'
-
-stages:
-- stage: Validate
-  displayName: 'Validate Bicep Templates'
-  jobs:
-  - job: ValidateJob
-    displayName: 'Validate Templates'
-    steps:
-    - task: AzureCLI@2
-      displayName: 'Validate Bicep Template'
-      inputs:
-        azureSubscription: $(azureSubscription)
-        scriptType: 'bash'
-        scriptLocation: 'inlineScript'
-        inlineScript: |
-          az bicep build --file $(templatePath)
-          az deployment group validate \\
-            --resource-group $(resourceGroupName) \\
-            --template-file $(templatePath) \\
-            --parameters @$(parametersPath)
-
-- stage: Deploy
-  displayName: 'Deploy to {environment.title()}'
-  dependsOn: Validate
-  jobs:
-  - deployment: DeployJob
-    displayName: 'Deploy Infrastructure'
-    environment: '{environment}'
-    strategy:
-      runOnce:
-        deploy:
-          steps:
-          - checkout: self
-          - task: AzureCLI@2
-            displayName: 'Deploy Infrastructure'
-            inputs:
-              azureSubscription: $(azureSubscription)
-              scriptType: 'bash'
-              scriptLocation: 'inlineScript'
-              inlineScript: |
-                az group create --name $(resourceGroupName) --location "$(location)"
-                az deployment group create \\
-                  --resource-group $(resourceGroupName) \\
-                  --template-file $(templatePath) \\
-                  --parameters @$(parametersPath) \\
-                  --verbose
-"""
+            template_name = 'pipeline_simple.yml.j2'
+        
+        return self._jinja.get_template(template_name).render(environment=environment)
     
     def _generate_fallback_readme(self, environment: str, cost_optimization: Dict[str, Any] = None) -> str:
         """Generate fallback README with cost optimization information"""
         
-        cost_info = ""
+        estimated_savings = 'N/A'
+        key_areas = ''
         if cost_optimization:
             optimization_summary = cost_optimization.get('optimization_summary', {})
             estimated_savings = optimization_summary.get('estimated_monthly_savings', 'N/A')
-            key_areas = optimization_summary.get('key_optimization_areas', [])
-            
-            cost_info = f"""
-## Cost Optimization
-
-This infrastructure has been optimized for cost efficiency using Microsoft's Well-Architected Framework:
-
-- **Estimated Monthly Savings**: {estimated_savings}
-- **Framework Applied**: Microsoft Well-Architected Framework - Cost Optimization
-- **Key Optimization Areas**: {', '.join(key_areas) if key_areas else 'Resource right-sizing, environment-specific configurations'}
-
-### Cost Optimization Features
-
-- Environment-specific resource SKUs
-- Auto-shutdown for development resources (if applicable)
-- Right-sized compute and storage resources
-- Optimized networking configurations
-"""
+            areas = optimization_summary.get('key_optimization_areas', [])
+            key_areas = ', '.join(areas) if areas else 'Resource right-sizing, environment-specific configurations'
         
-        return f"""
-# Digital Superman - Azure Infrastructure ({environment.title()})
-
-This repository contains the Azure infrastructure templates generated by Digital Superman for the **{environment.upper()}** environment.
-
-## Overview
-
-This infrastructure was automatically generated based on your Azure architecture diagram analysis and optimized for {environment} deployment with cost optimization applied.
-{cost_info}
-## Structure
-
-- `bicep/main.bicep` - Main Bicep template for {environment} with cost optimizations
-- `bicep/parameters/{environment}.parameters.json` - Environment-specific parameters
-- `azure-pipelines-{environment}.yml` - Azure DevOps CI/CD pipeline for {environment}
-- `deploy-{environment}.ps1` - PowerShell deployment script for {environment}
-
-## Environment: {environment.upper()}
-
-This configuration is specifically tailored for {environment} with appropriate:
-- Resource SKUs and configurations (cost optimized)
-- Security and compliance settings
-- Pipeline complexity and approval gates
-- Monitoring and backup requirements
-- Cost optimization features
-
-## Deployment
-
-### Prerequisites
-
-- Azure CLI installed and configured
-- Azure subscription with appropriate permissions
-- Azure DevOps project (for CI/CD)
-
-### Manual Deployment
-
-1. Login to Azure:
-   ```bash
-   az login
-   ```
-
-2. Create resource group:
-   ```bash
-   az group create --name rg-digitalsuperman --location "East US"
-   ```
-
-3. Deploy template:
-   ```bash
-   az deployment group create --resource-group rg-digitalsuperman --template-file main.bicep
-   ```
-
-### CI/CD Deployment
-
-1. Set up Azure DevOps service connection
-2. Import the pipeline from `azure-pipelines.yml`
-3. Configure pipeline variables
-4. Run the pipeline
-
-## Security
-
-This infrastructure follows Azure security best practices and compliance requirements.
-
-## Support
-
-For issues or questions, please refer to the compliance documentation.
-"""
+        return self._jinja.get_template('readme.md.j2').render(
+            environment=environment,
+            cost_optimization=cost_optimization,
+            estimated_savings=estimated_savings,
+            key_areas=key_areas
+        )
     
     def _generate_fallback_deploy_script(self, environment: str) -> str:
         """Generate fallback deployment script"""
-        return f"""
-param(
-    [Parameter(Mandatory=$false)]
-    [string]$ResourceGroupName = "rg-digitalsuperman-{environment}",
-    
-    [Parameter(Mandatory=$false)]
-    [string]$Location = "East US",
-    
-    [Parameter(Mandatory=$false)]
-    [string]$Environment = "{environment}",
-    
-    [Parameter(Mandatory=$false)]
-    [string]$TemplateFile = "bicep/main.bicep",
-    
-    [Parameter(Mandatory=$false)]
-    [string]$ParametersFile = "bicep/parameters/{environment}.parameters.json"
-)
-
-Write-Host "🚀 Digital Superman - Deploying Infrastructure for {environment.upper()}" -ForegroundColor Green
-Write-Host "Environment: $Environment" -ForegroundColor Cyan
-Write-Host "Resource Group: $ResourceGroupName" -ForegroundColor Cyan
-Write-Host "Location: $Location" -ForegroundColor Cyan
-
-# Check if Azure CLI is installed
-if (-not (Get-Command az -ErrorAction SilentlyContinue)) {{
-    Write-Error "❌ Azure CLI is not installed. Please install Azure CLI first."
-    exit 1
-}}
-
-# Check if logged in to Azure
-$account = az account show --query "id" -o tsv 2>$null
-if (-not $account) {{
-    Write-Host "⚠️ Not logged in to Azure. Please login first." -ForegroundColor Yellow
-    az login
-}}
-
-# Validate template files exist
-if (-not (Test-Path $TemplateFile)) {{
-    Write-Error "❌ Template file not found: $TemplateFile"
-    exit 1
-}}
-
-if (-not (Test-Path $ParametersFile)) {{
-    Write-Error "❌ Parameters file not found: $ParametersFile"
-    exit 1
-}}
-
-# Install Bicep CLI if not already installed
-Write-Host "🔧 Installing/Updating Bicep CLI..." -ForegroundColor Yellow
-az bicep install
-
-# Create resource group if it doesn't exist
-Write-Host "📦 Creating resource group: $ResourceGroupName" -ForegroundColor Yellow
-az group create --name $ResourceGroupName --location $Location
-
-# Validate template
-Write-Host "✅ Validating Bicep template..." -ForegroundColor Yellow
-az deployment group validate `
-    --resource-group $ResourceGroupName `
-    --template-file $TemplateFile `
-    --parameters @$ParametersFile
-
-if ($LASTEXITCODE -ne 0) {{
-    Write-Error "❌ Template validation failed!"
-    exit 1
-}}
-
-Write-Host "✅ Template validation successful!" -ForegroundColor Green
-
-# Deploy template
-Write-Host "🚀 Deploying infrastructure to {environment.upper()}..." -ForegroundColor Yellow
-az deployment group create `
-    --resource-group $ResourceGroupName `
-    --template-file $TemplateFile `
-    --parameters @$ParametersFile `
-    --verbose
-
-if ($LASTEXITCODE -eq 0) {{
-    Write-Host "✅ Deployment completed successfully!" -ForegroundColor Green
-    Write-Host "📋 Listing deployed resources:" -ForegroundColor Cyan
-    az resource list --resource-group $ResourceGroupName --output table
-}} else {{
-    Write-Error "❌ Deployment failed!"
-    exit 1
-}}
-
-Write-Host "🎉 Infrastructure deployment for {environment.upper()} completed!" -ForegroundColor Green
-"""
+        return self._jinja.get_template('deploy.ps1.j2').render(environment=environment)
     
     def _get_timestamp(self) -> str:
         """Get current timestamp"""
-        from datetime import datetime
         return datetime.now().isoformat()
     
     def _get_environment_requirements(self, environment: str) -> Dict[str, Any]:
         """Get environment-specific requirements for template generation"""
-        requirements = {
-            'development': {
-                'pipeline_complexity': 'simple',
-                'approval_gates': False,
-                'security_scans': 'basic',
-                'deployment_stages': ['validate', 'deploy'],
-                'sku_tier': 'basic',
-                'monitoring': 'basic',
-                'backup_required': False,
-                'multi_region': False
-            },
-            'staging': {
-                'pipeline_complexity': 'moderate',
-                'approval_gates': True,
-                'security_scans': 'standard',
-                'deployment_stages': ['validate', 'security-scan', 'deploy', 'test'],
-                'sku_tier': 'standard',
-                'monitoring': 'standard',
-                'backup_required': True,
-                'multi_region': False
-            },
-            'production': {
-                'pipeline_complexity': 'advanced',
-                'approval_gates': True,
-                'security_scans': 'comprehensive',
-                'deployment_stages': ['validate', 'security-scan', 'approval', 'deploy-staging', 'approval', 'deploy-production', 'smoke-test'],
-                'sku_tier': 'premium',
-                'monitoring': 'comprehensive',
-                'backup_required': True,
-                'multi_region': True
-            }
-        }
-        
-        return requirements.get(environment.lower(), requirements['development'])
+        return ENVIRONMENT_REQUIREMENTS.get(environment.lower(), ENVIRONMENT_REQUIREMENTS['development'])
     
     def _get_cache_key(self, architecture_analysis, policy_compliance, cost_optimization, environment):
         """Generate cache key including cost optimization"""
-        key_data = f"{str(architecture_analysis)}{str(policy_compliance)}{str(cost_optimization)}{environment}"
-        return hashlib.md5(key_data.encode()).hexdigest()
+        # Canonical (sorted-key) JSON so equal inputs hash equally regardless of key order.
+        # Each part is fed to the hasher on its own so only one serialized buffer is alive at a time.
+        hasher = _new_cache_key_hasher()
+        for part in (architecture_analysis, policy_compliance, cost_optimization, environment):
+            hasher.update(json_dumps_bytes(part, sort_keys=True))
+            hasher.update(b'\x1e')
+        return hasher.hexdigest()
     
     def _get_from_cache(self, cache_key):
-        """Get cached templates if available"""
-        return self._template_cache.get(cache_key)
+        """Get cached templates if available (memory first, then disk)"""
+        with self._cache_lock:
+            result = self._template_cache.get(cache_key)
+            if result is not None:
+                self._template_cache.move_to_end(cache_key)
+        if result is None:
+            result = self._disk_cache.get(cache_key)
+            if result is not None:
+                self._save_to_memory_cache(cache_key, result)
+        return result
     
     def _save_to_cache(self, cache_key, result):
-        """Save templates to cache"""
-        if len(self._template_cache) >= self._max_cache_size:
-            oldest_key = next(iter(self._template_cache))
-            del self._template_cache[oldest_key]
-        self._template_cache[cache_key] = result
+        """Save templates to the memory and disk caches"""
+        self._save_to_memory_cache(cache_key, result)
+        self._disk_cache.set(cache_key, result)
+    
+    def _save_to_memory_cache(self, cache_key, result):
+        """Save templates to the in-process cache"""
+        with self._cache_lock:
+            if cache_key in self._template_cache:
+                self._template_cache.move_to_end(cache_key)
+            elif len(self._template_cache) >= self._max_cache_size:
+                self._template_cache.popitem(last=False)
+            self._template_cache[cache_key] = result
     
-    def optimize_architecture_costs(self, architecture_analysis: Dict[str, Any], environment: str) -> Dict[str, Any]:
+    def optimize_architecture_costs(self, architecture_analysis: Dict[str, Any], environment: str) -> Mapping[str, Any]:
         """
         (DISABLED) Stub for cost optimization. Returns empty result.
         """
-        return {
-            'applied_optimizations': [],
-            'cost_savings_estimate': 0,
-            'optimized_components': [],
-            'recommendations': []
-        }
+        return _EMPTY_COST_RESULT
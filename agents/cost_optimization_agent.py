@@ -4,186 +4,529 @@ Analyzes Azure architecture and applies Microsoft's cost optimization framework
 Optimizes resources based on environment (development/production) before Bicep generation
 """
 
-import json
+import asyncio
+import copy
+import functools
+import logging
 import os
+import re
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
 from typing import Dict, List, Any, Tuple, Optional
 import openai
 from dotenv import load_dotenv
 import hashlib
+from utils.disk_cache import DiskLRUCache
+from utils.model_capabilities import supports_json_object
+from utils.fast_json import collect_streamed_response, extract_json_span, json_dumps_bytes, json_loads, JSONDecodeError
+
+# Cache keys use xxh3 when xxhash is installed, blake2b otherwise. Neither is
+# seeded per process, so keys written to the disk cache still match after a restart
+try:
+    import xxhash
+    _new_cache_key_hasher = xxhash.xxh3_128
+except ImportError:
+    _new_cache_key_hasher = functools.partial(hashlib.blake2b, digest_size=16)
 
 load_dotenv()
 
+# Setup logger
+logger = logging.getLogger(__name__)
+
+# Static prompt content kept byte-identical across requests so OpenAI/Azure
+# automatic prompt caching can match the prefix
+INSIGHTS_SYSTEM_PROMPT = "You are an expert Azure cost optimization consultant following Microsoft Well-Architected Framework principles."
+
+INSIGHTS_INSTRUCTIONS = """You are a Microsoft Azure cost optimization expert. Analyze the architecture described at the end of this message and provide advanced cost optimization insights.
+
+Provide JSON response with:
+1. "strategic_recommendations": 3-5 high-impact cost optimization strategies
+2. "architectural_patterns": Cost-effective architectural patterns to consider
+3. "monitoring_strategy": Cost monitoring and alerting recommendations
+4. "long_term_savings": Long-term cost optimization roadmap
+5. "risk_assessment": Potential risks of proposed optimizations
+6. "executive_narrative": A short executive summary paragraph of the cost optimization plan
+7. "risk_details": List of specific risks with a one-line mitigation each
+
+Focus on Microsoft Well-Architected Framework cost optimization principles.
+Ensure recommendations are specific to the environment given in the architecture context.
+"""
+
+# Output budget per architecture/environment in an insights response; the seven
+# fields fit comfortably and decode time grows with every generated token
+INSIGHTS_MAX_TOKENS = 1000
+
+# Fixed sampling seed so identical prompts produce the same insights
+INSIGHTS_SEED = 0
+
+# Bulleted or numbered lines in a plain-text AI response; the group is the text
+# after the marker and any further bullet characters
+_BULLET_RE = re.compile(r'(?:[•*-]|[1-3]\.)[•*\-1-9. ]*(.*)')
+
+# Numbers in savings ranges like "€50-150"
+_SAVINGS_RE = re.compile(r'\d+')
+
+@functools.lru_cache(maxsize=128)
+def _parse_savings_range(savings_str: str) -> Tuple[int, int]:
+    """Parse "€50-150" into (50, 150); a single number is both bounds, none is (0, 0)"""
+    numbers = _SAVINGS_RE.findall(savings_str)
+    if not numbers:
+        return 0, 0
+    numbers = numbers[:2]
+    return int(numbers[0]), int(numbers[-1])
+
+# Microsoft Well-Architected Framework cost optimization principles, built once at import time (read-only)
+COST_OPTIMIZATION_FRAMEWORK = MappingProxyType({
+    "principles": {
+        "right_sizing": {
+            "description": "Choose the right resources for your workload",
+            "strategies": [
+                "Start small and scale up based on actual usage",
+                "Use monitoring data to right-size resources",
+                "Consider burstable instances for variable workloads",
+                "Use appropriate storage tiers"
+            ]
+        },
+        "reserved_capacity": {
+            "description": "Use reserved instances and capacity for predictable workloads",
+            "strategies": [
+                "Purchase reserved instances for production workloads",
+                "Use Azure Hybrid Benefit for Windows/SQL licensing",
+                "Consider savings plans for flexible workloads"
+            ]
+        },
+        "spot_instances": {
+            "description": "Use spot instances for fault-tolerant workloads",
+            "strategies": [
+                "Use spot VMs for development/testing",
+                "Use spot instances for batch processing",
+                "Implement proper handling for interruptions"
+            ]
+        },
+        "automation": {
+            "description": "Automate resource management and scaling",
+            "strategies": [
+                "Auto-shutdown dev/test resources",
+                "Use auto-scaling for production workloads",
+                "Implement lifecycle management for storage"
+            ]
+        },
+        "monitoring": {
+            "description": "Monitor and optimize continuously",
+            "strategies": [
+                "Use Azure Cost Management and Billing",
+                "Set up cost alerts and budgets",
+                "Regular cost reviews and optimization"
+            ]
+        }
+    },
+    "environment_strategies": {
+        "development": {
+            "vm_sizes": ["Standard_B1s", "Standard_B2s", "Standard_D2s_v3"],
+            "app_service_tiers": ["F1", "D1", "B1"],
+            "sql_tiers": ["Basic", "S0"],
+            "storage_tiers": ["Standard_LRS"],
+            "features": {
+                "auto_shutdown": True,
+                "dev_test_pricing": True,
+                "minimal_redundancy": True,
+                "shared_resources": True
+            }
+        },
+        "staging": {
+            "vm_sizes": ["Standard_B2s", "Standard_D2s_v3", "Standard_D4s_v3"],
+            "app_service_tiers": ["B1", "B2", "S1"],
+            "sql_tiers": ["S0", "S1"],
+            "storage_tiers": ["Standard_LRS", "Standard_ZRS"],
+            "features": {
+                "auto_shutdown": False,
+                "dev_test_pricing": False,
+                "moderate_redundancy": True,
+                "shared_resources": False
+            }
+        },
+        "production": {
+            "vm_sizes": ["Standard_D2s_v3", "Standard_D4s_v3", "Standard_F4s_v2"],
+            "app_service_tiers": ["S1", "S2", "P1V2", "P2V2"],
+            "sql_tiers": ["S1", "S2", "P1", "P2"],
+            "storage_tiers": ["Standard_ZRS", "Standard_GRS", "Premium_LRS"],
+            "features": {
+                "auto_shutdown": False,
+                "dev_test_pricing": False,
+                "high_availability": True,
+                "reserved_instances": True,
+                "geo_redundancy": True
+            }
+        }
+    },
+    "resource_optimizations": {
+        "Microsoft.Compute/virtualMachines": {
+            "development": {
+                "recommended_sizes": ["Standard_B1s", "Standard_B2s"],
+                "auto_shutdown": "19:00-08:00",
+                "disk_type": "Standard_LRS"
+            },
+            "production": {
+                "recommended_sizes": ["Standard_D2s_v3", "Standard_D4s_v3"],
+                "availability_set": True,
+                "disk_type": "Premium_LRS",
+                "backup": True
+            }
+        },
+        "Microsoft.Web/serverfarms": {
+            "development": {
+                "recommended_tiers": ["F1", "D1", "B1"],
+                "auto_scale": False,
+                "instance_count": 1
+            },
+            "production": {
+                "recommended_tiers": ["S1", "S2", "P1V2"],
+                "auto_scale": True,
+                "min_instances": 2,
+                "max_instances": 10
+            }
+        },
+        "Microsoft.Sql/servers/databases": {
+            "development": {
+                "recommended_tiers": ["Basic", "S0"],
+                "backup_retention": 7,
+                "geo_replication": False
+            },
+            "production": {
+                "recommended_tiers": ["S2", "P1", "P2"],
+                "backup_retention": 35,
+                "geo_replication": True,
+                "threat_detection": True
+            }
+        },
+        "Microsoft.Storage/storageAccounts": {
+            "development": {
+                "recommended_tiers": ["Standard_LRS"],
+                "access_tier": "Hot",
+                "lifecycle_management": False
+            },
+            "production": {
+                "recommended_tiers": ["Standard_ZRS", "Standard_GRS"],
+                "access_tier": "Hot",
+                "lifecycle_management": True,
+                "soft_delete": True
+            }
+        }
+    }
+})
+
+# Architectures per optimize_architectures_batched insights call
+MAX_INSIGHTS_BATCH_SIZE = 8
+
+# Every resource yields one recommendation; below this the static insights are used
+# instead of an AI call, since the model has too little to add
+MIN_RECOMMENDATIONS_FOR_AI_INSIGHTS = 2
+
+# Analysis fields that optimize_architecture reads or copies into its result
+_CACHE_KEY_FIELDS = ('components', 'resources', 'metadata', 'relationships')
+
+# Display names mapped to normalized service types (handles both old and new naming conventions)
+_SERVICE_TYPE_MAPPING = MappingProxyType({
+    'app service': 'app_service',
+    'sql database': 'sql_database', 
+    'storage account': 'storage_account',
+    'virtual machine': 'virtual_machine',
+    'kubernetes service': 'kubernetes_service',
+    'container registry': 'container_registry',
+    'key vault': 'key_vault',
+    'cosmos db': 'cosmos_db',
+    'application gateway': 'application_gateway',
+    'load balancer': 'load_balancer',
+    'virtual network': 'virtual_network',
+    'network security group': 'network_security_group',
+    'active directory': 'active_directory',
+    'security center': 'security_center',
+    'data factory': 'data_factory',
+    'synapse analytics': 'synapse_analytics',
+    'machine learning': 'machine_learning',
+    'cognitive services': 'cognitive_services',
+    'iot hub': 'iot_hub',
+    'stream analytics': 'stream_analytics',
+    'power bi': 'power_bi',
+    'redis cache': 'redis_cache',
+    'service bus': 'service_bus',
+    'event hubs': 'event_hubs',
+    'api management': 'api_management',
+    'logic apps': 'logic_apps',
+    'monitor': 'azure_monitor',
+    'log analytics': 'log_analytics',
+    'azure devops': 'azure_devops',
+    'backup': 'azure_backup',
+    'site recovery': 'site_recovery',
+    'vpn gateway': 'vpn_gateway',
+    'firewall': 'azure_firewall',
+    'cdn': 'azure_cdn',
+    'functions': 'azure_functions'
+})
+
+# Per-service optimization rules: normalized type -> environment -> (recommendation, savings type,
+# estimated monthly savings). The None entry applies to any other environment (production).
+RESOURCE_OPTIMIZATION_RULES = MappingProxyType({
+    'app_service': {
+        'development': ("App Service {name}: Use F1/D1 tier for development (€0-15/month)", 'app_service_dev_tier', '€30-80'),
+        'staging': ("App Service {name}: Use S1 tier for staging (€50/month)", 'app_service_staging_tier', '€20-50'),
+        None: ("App Service {name}: Consider P1V2 with auto-scaling (€70-200/month)", 'app_service_auto_scaling', '€50-150')
+    },
+    'virtual_machine': {
+        'development': ("VM {name}: Use B-Series burstable VMs with auto-shutdown", 'vm_dev_optimization', '€100-300'),
+        'staging': ("VM {name}: Use Standard_D2s_v3 with scheduled shutdown", 'vm_staging_optimization', '€50-150'),
+        None: ("VM {name}: Consider Reserved Instances for 1-3 year terms", 'vm_reserved_instances', '€200-600')
+    },
+    'sql_database': {
+        'development': ("SQL Database {name}: Use Basic tier (€4-15/month)", 'sql_basic_tier', '€50-150'),
+        'staging': ("SQL Database {name}: Use S1 Standard tier (€20/month)", 'sql_standard_tier', '€30-100'),
+        None: ("SQL Database {name}: Consider elastic pools for multiple DBs", 'sql_elastic_pools', '€100-400')
+    },
+    'storage_account': {
+        None: ("Storage {name}: Use appropriate access tiers (Hot/Cool/Archive)", 'storage_tiering', '€20-100')
+    },
+    'kubernetes_service': {
+        'development': ("AKS {name}: Use smaller node sizes and auto-scaling", 'aks_dev_optimization', '€150-500'),
+        None: ("AKS {name}: Use spot instances for non-critical workloads", 'aks_spot_instances', '€200-800')
+    }
+})
+
+# Closing sections of generate_cost_optimization_report, identical for every report
+_REPORT_FOOTER = """## Microsoft Well-Architected Framework Compliance
+
+This optimization follows the five key principles of cost optimization:
+• **Plan and estimate costs** - Detailed cost analysis and estimation
+• **Provision with optimization** - Right-sized resources for environment
+• **Use monitoring and analytics** - Recommendations for cost monitoring
+• **Maximize efficiency** - Auto-scaling and automation recommendations
+• **Optimize over time** - Continuous optimization roadmap
+
+## Important Notes
+
+• Cost savings estimates are approximate and may vary based on actual usage
+• Implement changes in non-production environments first
+• Monitor performance impact after implementing optimizations
+• Review and update optimizations regularly as usage patterns change"""
+
+# Framework principles the template insights draw on per environment (use_ai=False);
+# other environment names use the production set, like the generic recommendations
+_TEMPLATE_INSIGHT_PRINCIPLES = MappingProxyType({
+    'development': ('right_sizing', 'spot_instances', 'automation'),
+    'staging': ('right_sizing', 'automation', 'reserved_capacity'),
+    'production': ('reserved_capacity', 'right_sizing', 'automation')
+})
+
+_TEMPLATE_RISK_DETAILS = (
+    "Undersized resources after right-sizing - review utilization metrics for two weeks before downsizing",
+    "Reserved capacity commitments outliving the workload - start with 1-year terms",
+    "Auto-scaling rules reacting too slowly - load test scale-out thresholds before rollout"
+)
+
+# Alternate normalized names that share a rule set
+_RESOURCE_TYPE_ALIASES = {
+    'web_app': 'app_service',
+    'vm': 'virtual_machine',
+    'azure_sql': 'sql_database',
+    'blob_storage': 'storage_account',
+    'aks': 'kubernetes_service'
+}
+
+# Generic results only depend on the environment, so each one is built once
+@functools.lru_cache(maxsize=8)
+def _build_generic_optimization_recommendations(environment: str) -> Dict[str, Any]:
+    """Build the generic optimization result for an environment"""
+    
+    # Generic recommendations based on environment
+    if environment == 'development':
+        recommendations = [
+            "Enable auto-shutdown for development VMs (18:00 UTC daily)",
+            "Use B-Series burstable VMs for variable development workloads",
+            "Implement Azure Dev/Test pricing for eligible resources",
+            "Use Standard_LRS storage for non-critical development data",
+            "Configure F1/D1 tier App Service plans for development applications",
+            "Use Basic tier SQL databases for development environments",
+            "Implement resource tagging for cost tracking and management"
+        ]
+        estimated_savings = "€200-500"
+        annual_savings = "€2,400-6,000"
+    elif environment == 'staging':
+        recommendations = [
+            "Use Standard_B2s VMs for staging workloads",
+            "Implement auto-scaling for App Service plans",
+            "Use Standard_S1 SQL database tier for staging",
+            "Configure automated backup retention policies",
+            "Implement Azure Hybrid Benefit where applicable",
+            "Use Standard_GRS storage for important staging data",
+            "Set up cost alerts and budgets for staging resources"
+        ]
+        estimated_savings = "€300-700"
+        annual_savings = "€3,600-8,400"
+    else:  # production
+        recommendations = [
+            "Implement Reserved Instances for production VMs (1-3 year terms)",
+            "Use Premium SSD with appropriate IOPS for production workloads",
+            "Configure auto-scaling for production App Service plans",
+            "Implement SQL Database elastic pools for multiple databases",
+            "Use Azure Hybrid Benefit for Windows Server and SQL licenses",
+            "Set up monitoring and alerting for cost optimization",
+            "Regular right-sizing analysis based on actual usage metrics"
+        ]
+        estimated_savings = "€500-1,500"
+        annual_savings = "€6,000-18,000"
+    
+    # Generic cost savings structure
+    cost_savings = [{
+        "generic_optimization": {
+            "type": "azure_best_practices",
+            "estimated_monthly_savings": estimated_savings
+        }
+    }]
+    
+    # AI insights for generic recommendations
+    ai_insights = {
+        "strategic_recommendations": [
+            f"Implement Microsoft Well-Architected Framework cost optimization principles for {environment} environment",
+            "Set up Azure Cost Management and Billing for continuous monitoring",
+            "Establish cost governance policies and regular review processes",
+            "Consider Azure Advisor recommendations for ongoing optimization"
+        ],
+        "implementation_priority": "High" if environment == "production" else "Medium",
+        "monitoring_setup": [
+            "Configure cost alerts at 80% and 100% of budget",
+            "Set up monthly cost review meetings",
+            "Implement resource tagging strategy for cost allocation"
+        ]
+    }
+    
+    # Create optimization summary
+    optimization_summary = {
+        'environment': environment,
+        'optimization_framework': 'Microsoft Well-Architected Framework',
+        'total_recommendations': len(recommendations),
+        'estimated_monthly_savings': estimated_savings,
+        'estimated_annual_savings': annual_savings,
+        'key_optimization_areas': [
+            'Resource right-sizing',
+            'Environment-specific configurations',
+            'Auto-scaling and automation',
+            'Reserved capacity planning'
+        ],
+        'implementation_priority': 'High' if environment == 'production' else 'Medium',
+        'ai_insights_available': True,
+        'framework_compliance': 'High',
+        'next_steps': [
+            'Review and approve optimization recommendations',
+            'Implement cost optimization best practices',
+            'Set up cost monitoring and alerts',
+            'Schedule regular cost optimization reviews'
+        ]
+    }
+    
+    return {
+        'optimized_architecture': {
+            'components': [],
+            'metadata': {'cost_optimized': True, 'generic_recommendations': True},
+            'relationships': []
+        },
+        'optimization_recommendations': recommendations,
+        'cost_savings': cost_savings,
+        'ai_insights': ai_insights,
+        'optimization_summary': optimization_summary,
+        'environment': environment,
+        'framework_applied': 'Microsoft Well-Architected Framework - Cost Optimization',
+        'bicep_generation_hints': {
+            'environment_configurations': {
+                'environment': environment,
+                'cost_optimized': True,
+                'generic_optimization': True
+            }
+        }
+    }
+
+
+@functools.lru_cache(maxsize=4)
+def _get_openai_client(azure_endpoint: Optional[str], api_key: Optional[str], api_version: Optional[str]):
+    """OpenAI client per credential set, shared by all agent instances so they reuse one connection pool"""
+    if azure_endpoint:
+        return openai.AzureOpenAI(
+            azure_endpoint=azure_endpoint,
+            api_key=api_key,
+            api_version=api_version
+        )
+    return openai.OpenAI(api_key=api_key)
+
 class CostOptimizationAgent:
-    def __init__(self):
+    def __init__(self, use_ai: Optional[bool] = None):
         # Check if Azure AI Foundry configuration is available
         self.azure_endpoint = os.getenv('AZURE_AI_AGENT3_ENDPOINT')
         self.azure_key = os.getenv('AZURE_AI_AGENT3_KEY')
         self.azure_deployment = os.getenv('AZURE_AI_AGENT3_DEPLOYMENT', 'gpt-4')
         
-        if self.azure_endpoint and self.azure_key:
-            # Use Azure AI Foundry endpoint
-            self.openai_client = openai.AzureOpenAI(
-                azure_endpoint=self.azure_endpoint,
-                api_key=self.azure_key,
-                api_version="2024-02-01"
-            )
-            self.model_name = self.azure_deployment
-            print(f"✅ Cost Optimization Agent: Using Azure AI Foundry endpoint")
-        else:
-            # Fallback to OpenAI
-            self.openai_client = openai.OpenAI(
-                api_key=os.getenv('OPENAI_API_KEY')
-            )
-            self.model_name = "gpt-4"
-            print(f"⚠️ Cost Optimization Agent: Using OpenAI fallback (configure Azure AI Foundry for production)")
+        # The OpenAI client is built on first use (see openai_client) so cached
+        # and report-only paths skip the client setup
+        
+        # With use_ai off, insights come from the framework templates and no OpenAI call is made
+        if use_ai is None:
+            use_ai = os.getenv('COST_OPT_USE_AI', 'True').lower() == 'true'
+        self.use_ai = use_ai
         
         # Load Microsoft Cost Optimization Framework
         self.cost_optimization_framework = self._load_cost_optimization_framework()
         
-        # Cache for optimization recommendations
-        self._optimization_cache = {}
+        # Cache for optimization recommendations (least recently used evicted first)
+        self._optimization_cache = OrderedDict()
         self._max_cache_size = 50
+        self._cache_lock = threading.Lock()  # async callers run optimizations on worker threads
+        
+        # AI insights keyed by the rendered prompt (least recently used evicted first)
+        self._ai_insights_cache = OrderedDict()
+        
+        # The disk cache is opened on first use (see _disk_cache) so report-only callers
+        # such as the ZIP generator never touch SQLite
+
+    @functools.cached_property
+    def _disk_cache(self) -> DiskLRUCache:
+        """Disk-backed LRU so optimization results survive restarts, opened on first access"""
+        # Lives in the project's .cache directory (not the working directory) unless COST_OPT_CACHE_PATH is set
+        return DiskLRUCache(
+            os.getenv(
+                'COST_OPT_CACHE_PATH',
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'cost_optimization.sqlite3')
+            ),
+            max_entries=500,
+            expire_seconds=7 * 24 * 3600
+        )
 
+    @functools.cached_property
+    def openai_client(self):
+        """OpenAI client, constructed on first access"""
+        if self.azure_endpoint and self.azure_key:
+            # Use Azure AI Foundry endpoint
+            print(f"✅ Cost Optimization Agent: Using Azure AI Foundry endpoint")
+            return _get_openai_client(self.azure_endpoint, self.azure_key, "2024-10-21")
+        
+        # Fallback to OpenAI
+        print(f"⚠️ Cost Optimization Agent: Using OpenAI fallback (configure Azure AI Foundry for production)")
+        return _get_openai_client(None, os.getenv('OPENAI_API_KEY'), None)
+    
+    @functools.cached_property
+    def model_name(self) -> str:
+        """Deployment or model name matching openai_client"""
+        if self.azure_endpoint and self.azure_key:
+            return self.azure_deployment
+        return "gpt-4"
+    
+    @functools.cached_property
+    def response_format(self):
+        """JSON mode when model_name supports it; plain gpt-4 rejects response_format with a 400"""
+        if supports_json_object(self.model_name):
+            return {"type": "json_object"}
+        return openai.NOT_GIVEN
+    
     def _load_cost_optimization_framework(self) -> Dict[str, Any]:
         """Load Microsoft's Well-Architected Framework cost optimization principles"""
-        return {
-            "principles": {
-                "right_sizing": {
-                    "description": "Choose the right resources for your workload",
-                    "strategies": [
-                        "Start small and scale up based on actual usage",
-                        "Use monitoring data to right-size resources",
-                        "Consider burstable instances for variable workloads",
-                        "Use appropriate storage tiers"
-                    ]
-                },
-                "reserved_capacity": {
-                    "description": "Use reserved instances and capacity for predictable workloads",
-                    "strategies": [
-                        "Purchase reserved instances for production workloads",
-                        "Use Azure Hybrid Benefit for Windows/SQL licensing",
-                        "Consider savings plans for flexible workloads"
-                    ]
-                },
-                "spot_instances": {
-                    "description": "Use spot instances for fault-tolerant workloads",
-                    "strategies": [
-                        "Use spot VMs for development/testing",
-                        "Use spot instances for batch processing",
-                        "Implement proper handling for interruptions"
-                    ]
-                },
-                "automation": {
-                    "description": "Automate resource management and scaling",
-                    "strategies": [
-                        "Auto-shutdown dev/test resources",
-                        "Use auto-scaling for production workloads",
-                        "Implement lifecycle management for storage"
-                    ]
-                },
-                "monitoring": {
-                    "description": "Monitor and optimize continuously",
-                    "strategies": [
-                        "Use Azure Cost Management and Billing",
-                        "Set up cost alerts and budgets",
-                        "Regular cost reviews and optimization"
-                    ]
-                }
-            },
-            "environment_strategies": {
-                "development": {
-                    "vm_sizes": ["Standard_B1s", "Standard_B2s", "Standard_D2s_v3"],
-                    "app_service_tiers": ["F1", "D1", "B1"],
-                    "sql_tiers": ["Basic", "S0"],
-                    "storage_tiers": ["Standard_LRS"],
-                    "features": {
-                        "auto_shutdown": True,
-                        "dev_test_pricing": True,
-                        "minimal_redundancy": True,
-                        "shared_resources": True
-                    }
-                },
-                "staging": {
-                    "vm_sizes": ["Standard_B2s", "Standard_D2s_v3", "Standard_D4s_v3"],
-                    "app_service_tiers": ["B1", "B2", "S1"],
-                    "sql_tiers": ["S0", "S1"],
-                    "storage_tiers": ["Standard_LRS", "Standard_ZRS"],
-                    "features": {
-                        "auto_shutdown": False,
-                        "dev_test_pricing": False,
-                        "moderate_redundancy": True,
-                        "shared_resources": False
-                    }
-                },
-                "production": {
-                    "vm_sizes": ["Standard_D2s_v3", "Standard_D4s_v3", "Standard_F4s_v2"],
-                    "app_service_tiers": ["S1", "S2", "P1V2", "P2V2"],
-                    "sql_tiers": ["S1", "S2", "P1", "P2"],
-                    "storage_tiers": ["Standard_ZRS", "Standard_GRS", "Premium_LRS"],
-                    "features": {
-                        "auto_shutdown": False,
-                        "dev_test_pricing": False,
-                        "high_availability": True,
-                        "reserved_instances": True,
-                        "geo_redundancy": True
-                    }
-                }
-            },
-            "resource_optimizations": {
-                "Microsoft.Compute/virtualMachines": {
-                    "development": {
-                        "recommended_sizes": ["Standard_B1s", "Standard_B2s"],
-                        "auto_shutdown": "19:00-08:00",
-                        "disk_type": "Standard_LRS"
-                    },
-                    "production": {
-                        "recommended_sizes": ["Standard_D2s_v3", "Standard_D4s_v3"],
-                        "availability_set": True,
-                        "disk_type": "Premium_LRS",
-                        "backup": True
-                    }
-                },
-                "Microsoft.Web/serverfarms": {
-                    "development": {
-                        "recommended_tiers": ["F1", "D1", "B1"],
-                        "auto_scale": False,
-                        "instance_count": 1
-                    },
-                    "production": {
-                        "recommended_tiers": ["S1", "S2", "P1V2"],
-                        "auto_scale": True,
-                        "min_instances": 2,
-                        "max_instances": 10
-                    }
-                },
-                "Microsoft.Sql/servers/databases": {
-                    "development": {
-                        "recommended_tiers": ["Basic", "S0"],
-                        "backup_retention": 7,
-                        "geo_replication": False
-                    },
-                    "production": {
-                        "recommended_tiers": ["S2", "P1", "P2"],
-                        "backup_retention": 35,
-                        "geo_replication": True,
-                        "threat_detection": True
-                    }
-                },
-                "Microsoft.Storage/storageAccounts": {
-                    "development": {
-                        "recommended_tiers": ["Standard_LRS"],
-                        "access_tier": "Hot",
-                        "lifecycle_management": False
-                    },
-                    "production": {
-                        "recommended_tiers": ["Standard_ZRS", "Standard_GRS"],
-                        "access_tier": "Hot",
-                        "lifecycle_management": True,
-                        "soft_delete": True
-                    }
-                }
-            }
-        }
+        return COST_OPTIMIZATION_FRAMEWORK
     
     def optimize_architecture(self, architecture_analysis: Dict[str, Any], policy_compliance: Dict[str, Any], environment: str = 'development') -> Dict[str, Any]:
         """
@@ -200,9 +543,7 @@ class CostOptimizationAgent:
                 return cached_result
             
             # Extract components and resources
-            components = architecture_analysis.get('components', [])
-            resources = architecture_analysis.get('resources', [])
-            all_resources = components + resources
+            all_resources = self._collect_resources(architecture_analysis)
             
             # If no resources detected, provide generic optimization recommendations
             if not all_resources:
@@ -210,43 +551,22 @@ class CostOptimizationAgent:
                 return self._generate_generic_optimization_recommendations(environment)
             
             # Apply cost optimization strategies
-            optimized_resources = []
-            optimization_recommendations = []
-            cost_savings = []
-            
-            for resource in all_resources:
-                optimized_resource, recommendations, savings = self._optimize_resource(resource, environment, policy_compliance)
-                optimized_resources.append(optimized_resource)
-                optimization_recommendations.extend(recommendations)
-                if savings:
-                    cost_savings.append(savings)
+            optimized_resources, optimization_recommendations, cost_savings = self._apply_resource_optimizations(
+                all_resources, environment, policy_compliance
+            )
             
             # Generate AI-powered optimization insights
             ai_insights = self._generate_ai_optimization_insights(architecture_analysis, environment, optimization_recommendations)
             
-            # Create optimization summary
-            optimization_summary = self._create_optimization_summary(
-                environment, 
-                optimization_recommendations, 
-                cost_savings, 
+            result = self._assemble_optimization_result(
+                architecture_analysis,
+                environment,
+                optimized_resources,
+                optimization_recommendations,
+                cost_savings,
                 ai_insights
             )
             
-            result = {
-                'optimized_architecture': {
-                    'components': optimized_resources,
-                    'metadata': architecture_analysis.get('metadata', {}),
-                    'relationships': architecture_analysis.get('relationships', [])
-                },
-                'optimization_recommendations': optimization_recommendations,
-                'cost_savings': cost_savings,
-                'ai_insights': ai_insights,
-                'optimization_summary': optimization_summary,
-                'environment': environment,
-                'framework_applied': 'Microsoft Well-Architected Framework - Cost Optimization',
-                'bicep_generation_hints': self._generate_bicep_hints(optimized_resources, environment)
-            }
-            
             # Cache the result
             self._add_to_cache(cache_key, result)
             
@@ -254,168 +574,181 @@ class CostOptimizationAgent:
             return result
             
         except Exception as e:
-            print(f"❌ Cost Optimization Agent: Error during optimization: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            # The fallback result covers the failure; the stack trace is only worth formatting when debugging
+            logger.warning(f"❌ Cost Optimization Agent: Error during optimization: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
             return self._generate_generic_optimization_recommendations(environment)
     
-    def _generate_generic_optimization_recommendations(self, environment: str) -> Dict[str, Any]:
-        """Generate generic Azure cost optimization recommendations when no specific resources are detected"""
+    async def optimize_architecture_async(self, architecture_analysis: Dict[str, Any], policy_compliance: Dict[str, Any], environment: str = 'development') -> Dict[str, Any]:
+        """
+        Awaitable variant of optimize_architecture so callers can gather several
+        environments or architectures and overlap their AI insights calls
+        """
+        return await asyncio.to_thread(self.optimize_architecture, architecture_analysis, policy_compliance, environment)
+    
+    def optimize_architecture_multi(self, architecture_analysis: Dict[str, Any], policy_compliance: Dict[str, Any], environments: Tuple[str, ...] = ('development', 'staging', 'production')) -> Dict[str, Dict[str, Any]]:
+        """
+        Optimize one architecture for several environments, sharing a single AI insights call
+        """
+        results = {}
+        pending = {}
+        for environment in environments:
+            cache_key = self._get_cache_key(architecture_analysis, environment)
+            cached_result = self._get_from_cache(cache_key)
+            if cached_result:
+                results[environment] = cached_result
+            else:
+                pending[environment] = cache_key
         
-        # Generic recommendations based on environment
-        if environment == 'development':
-            recommendations = [
-                "Enable auto-shutdown for development VMs (18:00 UTC daily)",
-                "Use B-Series burstable VMs for variable development workloads",
-                "Implement Azure Dev/Test pricing for eligible resources",
-                "Use Standard_LRS storage for non-critical development data",
-                "Configure F1/D1 tier App Service plans for development applications",
-                "Use Basic tier SQL databases for development environments",
-                "Implement resource tagging for cost tracking and management"
-            ]
-            estimated_savings = "€200-500"
-            annual_savings = "€2,400-6,000"
-        elif environment == 'staging':
-            recommendations = [
-                "Use Standard_B2s VMs for staging workloads",
-                "Implement auto-scaling for App Service plans",
-                "Use Standard_S1 SQL database tier for staging",
-                "Configure automated backup retention policies",
-                "Implement Azure Hybrid Benefit where applicable",
-                "Use Standard_GRS storage for important staging data",
-                "Set up cost alerts and budgets for staging resources"
-            ]
-            estimated_savings = "€300-700"
-            annual_savings = "€3,600-8,400"
-        else:  # production
-            recommendations = [
-                "Implement Reserved Instances for production VMs (1-3 year terms)",
-                "Use Premium SSD with appropriate IOPS for production workloads",
-                "Configure auto-scaling for production App Service plans",
-                "Implement SQL Database elastic pools for multiple databases",
-                "Use Azure Hybrid Benefit for Windows Server and SQL licenses",
-                "Set up monitoring and alerting for cost optimization",
-                "Regular right-sizing analysis based on actual usage metrics"
-            ]
-            estimated_savings = "€500-1,500"
-            annual_savings = "€6,000-18,000"
-        
-        # Generic cost savings structure
-        cost_savings = [{
-            "generic_optimization": {
-                "type": "azure_best_practices",
-                "estimated_monthly_savings": estimated_savings
-            }
-        }]
+        if pending:
+            try:
+                print(f"🔧 Cost Optimization Agent: Starting optimization for {', '.join(pending)} environments")
+                all_resources = self._collect_resources(architecture_analysis)
+                if not all_resources:
+                    print("⚠️ Cost Optimizer: No resources detected, providing generic Azure cost optimization")
+                    for environment in pending:
+                        results[environment] = self._generate_generic_optimization_recommendations(environment)
+                else:
+                    optimizations = {
+                        environment: self._apply_resource_optimizations(all_resources, environment, policy_compliance)
+                        for environment in pending
+                    }
+                    ai_insights = self._generate_ai_optimization_insights_multi(
+                        architecture_analysis,
+                        {environment: optimization[1] for environment, optimization in optimizations.items()}
+                    )
+                    for environment, (optimized_resources, optimization_recommendations, cost_savings) in optimizations.items():
+                        result = self._assemble_optimization_result(
+                            architecture_analysis,
+                            environment,
+                            optimized_resources,
+                            optimization_recommendations,
+                            cost_savings,
+                            ai_insights[environment]
+                        )
+                        self._add_to_cache(pending[environment], result)
+                        results[environment] = result
+            except Exception as e:
+                logger.warning(f"❌ Cost Optimization Agent: Error during optimization: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
+                for environment in pending:
+                    results.setdefault(environment, self._generate_generic_optimization_recommendations(environment))
         
-        # AI insights for generic recommendations
-        ai_insights = {
-            "strategic_recommendations": [
-                f"Implement Microsoft Well-Architected Framework cost optimization principles for {environment} environment",
-                "Set up Azure Cost Management and Billing for continuous monitoring",
-                "Establish cost governance policies and regular review processes",
-                "Consider Azure Advisor recommendations for ongoing optimization"
-            ],
-            "implementation_priority": "High" if environment == "production" else "Medium",
-            "monitoring_setup": [
-                "Configure cost alerts at 80% and 100% of budget",
-                "Set up monthly cost review meetings",
-                "Implement resource tagging strategy for cost allocation"
-            ]
-        }
+        return {environment: results[environment] for environment in environments}
+    
+    def optimize_architectures_batched(self, architecture_analyses: List[Dict[str, Any]], policy_compliance: Dict[str, Any] = None, environment: str = 'development') -> List[Dict[str, Any]]:
+        """
+        Optimize several architectures for one environment, sharing one AI insights call per batch
+        """
+        policy_compliance = policy_compliance or {}
+        results = [None] * len(architecture_analyses)
+        pending = []
+        for index, architecture_analysis in enumerate(architecture_analyses):
+            cache_key = self._get_cache_key(architecture_analysis, environment)
+            cached_result = self._get_from_cache(cache_key)
+            if cached_result:
+                results[index] = cached_result
+                continue
+            
+            all_resources = self._collect_resources(architecture_analysis)
+            if not all_resources:
+                results[index] = self._generate_generic_optimization_recommendations(environment)
+                continue
+            
+            optimization = self._apply_resource_optimizations(all_resources, environment, policy_compliance)
+            if len(optimization[1]) < MIN_RECOMMENDATIONS_FOR_AI_INSIGHTS:
+                # Trivial architectures get the static insights and stay out of the AI batches
+                result = self._assemble_optimization_result(architecture_analysis, environment, *optimization, self._fallback_ai_insights())
+                self._add_to_cache(cache_key, result)
+                results[index] = result
+                continue
+            pending.append((index, cache_key, optimization))
         
+        # Larger batches stop paying off once the response gets long, so cap each call
+        for batch_start in range(0, len(pending), MAX_INSIGHTS_BATCH_SIZE):
+            batch = pending[batch_start:batch_start + MAX_INSIGHTS_BATCH_SIZE]
+            ai_insights = self._generate_ai_optimization_insights_batch(
+                [architecture_analyses[index] for index, _, _ in batch],
+                environment,
+                [optimization[1] for _, _, optimization in batch]
+            )
+            for (index, cache_key, (optimized_resources, optimization_recommendations, cost_savings)), insights in zip(batch, ai_insights):
+                result = self._assemble_optimization_result(
+                    architecture_analyses[index],
+                    environment,
+                    optimized_resources,
+                    optimization_recommendations,
+                    cost_savings,
+                    insights
+                )
+                self._add_to_cache(cache_key, result)
+                results[index] = result
+        
+        return results
+    
+    def _collect_resources(self, architecture_analysis: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Components followed by resources, keeping the first entry for each (type, name)"""
+        # Upstream agents may list the same resource under both keys
+        seen = set()
+        all_resources = []
+        for resource in architecture_analysis.get('components', []) + architecture_analysis.get('resources', []):
+            key = (resource.get('type'), resource.get('name'))
+            if key not in seen:
+                seen.add(key)
+                all_resources.append(resource)
+        return all_resources
+    
+    def _apply_resource_optimizations(self, all_resources: List[Dict[str, Any]], environment: str, policy_compliance: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[str], List[Dict[str, Any]]]:
+        """Apply environment-specific optimizations to every resource"""
+        optimized_resources = []
+        optimization_recommendations = []
+        cost_savings = []
+        
+        for resource in all_resources:
+            optimized_resource, recommendations, savings = self._optimize_resource(resource, environment, policy_compliance)
+            optimized_resources.append(optimized_resource)
+            optimization_recommendations.extend(recommendations)
+            if savings:
+                cost_savings.append(savings)
+        
+        return optimized_resources, optimization_recommendations, cost_savings
+    
+    def _assemble_optimization_result(self, architecture_analysis: Dict[str, Any], environment: str, optimized_resources: List[Dict[str, Any]], optimization_recommendations: List[str], cost_savings: List[Dict[str, Any]], ai_insights: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the optimization result returned to callers"""
         # Create optimization summary
-        optimization_summary = {
-            'environment': environment,
-            'optimization_framework': 'Microsoft Well-Architected Framework',
-            'total_recommendations': len(recommendations),
-            'estimated_monthly_savings': estimated_savings,
-            'estimated_annual_savings': annual_savings,
-            'key_optimization_areas': [
-                'Resource right-sizing',
-                'Environment-specific configurations',
-                'Auto-scaling and automation',
-                'Reserved capacity planning'
-            ],
-            'implementation_priority': 'High' if environment == 'production' else 'Medium',
-            'ai_insights_available': True,
-            'framework_compliance': 'High',
-            'next_steps': [
-                'Review and approve optimization recommendations',
-                'Implement cost optimization best practices',
-                'Set up cost monitoring and alerts',
-                'Schedule regular cost optimization reviews'
-            ]
-        }
+        optimization_summary = self._create_optimization_summary(
+            environment, 
+            optimization_recommendations, 
+            cost_savings, 
+            ai_insights
+        )
         
         return {
             'optimized_architecture': {
-                'components': [],
-                'metadata': {'cost_optimized': True, 'generic_recommendations': True},
-                'relationships': []
+                'components': optimized_resources,
+                'metadata': architecture_analysis.get('metadata', {}),
+                'relationships': architecture_analysis.get('relationships', [])
             },
-            'optimization_recommendations': recommendations,
+            'optimization_recommendations': optimization_recommendations,
             'cost_savings': cost_savings,
             'ai_insights': ai_insights,
             'optimization_summary': optimization_summary,
             'environment': environment,
             'framework_applied': 'Microsoft Well-Architected Framework - Cost Optimization',
-            'bicep_generation_hints': {
-                'environment_configurations': {
-                    'environment': environment,
-                    'cost_optimized': True,
-                    'generic_optimization': True
-                }
-            }
+            'bicep_generation_hints': self._generate_bicep_hints(optimized_resources, environment)
         }
     
+    def _generate_generic_optimization_recommendations(self, environment: str) -> Dict[str, Any]:
+        """Generate generic Azure cost optimization recommendations when no specific resources are detected"""
+        # Deep copy so callers can edit the result without touching the cached one
+        return copy.deepcopy(_build_generic_optimization_recommendations(environment))
+    
     def _normalize_service_type(self, service_type: str) -> str:
         """Normalize service type names for consistent matching"""
-        # Handle both old and new naming conventions
-        service_mapping = {
-            'app service': 'app_service',
-            'sql database': 'sql_database', 
-            'storage account': 'storage_account',
-            'virtual machine': 'virtual_machine',
-            'kubernetes service': 'kubernetes_service',
-            'container registry': 'container_registry',
-            'key vault': 'key_vault',
-            'cosmos db': 'cosmos_db',
-            'application gateway': 'application_gateway',
-            'load balancer': 'load_balancer',
-            'virtual network': 'virtual_network',
-            'network security group': 'network_security_group',
-            'active directory': 'active_directory',
-            'security center': 'security_center',
-            'data factory': 'data_factory',
-            'synapse analytics': 'synapse_analytics',
-            'machine learning': 'machine_learning',
-            'cognitive services': 'cognitive_services',
-            'iot hub': 'iot_hub',
-            'stream analytics': 'stream_analytics',
-            'power bi': 'power_bi',
-            'redis cache': 'redis_cache',
-            'service bus': 'service_bus',
-            'event hubs': 'event_hubs',
-            'api management': 'api_management',
-            'logic apps': 'logic_apps',
-            'monitor': 'azure_monitor',
-            'log analytics': 'log_analytics',
-            'azure devops': 'azure_devops',
-            'backup': 'azure_backup',
-            'site recovery': 'site_recovery',
-            'vpn gateway': 'vpn_gateway',
-            'firewall': 'azure_firewall',
-            'cdn': 'azure_cdn',
-            'functions': 'azure_functions'
-        }
-        
         # Normalize to lowercase and handle spaces/underscores
         normalized = service_type.lower().strip()
         
         # Apply mapping if exists
-        if normalized in service_mapping:
-            return service_mapping[normalized]
+        if normalized in _SERVICE_TYPE_MAPPING:
+            return _SERVICE_TYPE_MAPPING[normalized]
         
         # Convert spaces to underscores if not in mapping
         return normalized.replace(' ', '_')
@@ -425,58 +758,17 @@ class CostOptimizationAgent:
         resource_type = self._normalize_service_type(resource.get('type', ''))
         resource_name = resource.get('name', 'Unknown')
         
-        # Create optimized copy of resource
-        optimized_resource = resource.copy()
-        optimized_resource['type'] = resource_type  # Update with normalized type
+        # Create optimized copy of resource with the normalized type
+        optimized_resource = {**resource, 'type': resource_type}
         recommendations = []
         savings = {}
         
         # Apply environment-specific optimizations based on service type
-        if resource_type in ['app_service', 'web_app']:
-            if environment == 'development':
-                recommendations.append(f"App Service {resource_name}: Use F1/D1 tier for development (€0-15/month)")
-                savings[resource_name] = {'type': 'app_service_dev_tier', 'estimated_monthly_savings': '€30-80'}
-            elif environment == 'staging':
-                recommendations.append(f"App Service {resource_name}: Use S1 tier for staging (€50/month)")
-                savings[resource_name] = {'type': 'app_service_staging_tier', 'estimated_monthly_savings': '€20-50'}
-            else:  # production
-                recommendations.append(f"App Service {resource_name}: Consider P1V2 with auto-scaling (€70-200/month)")
-                savings[resource_name] = {'type': 'app_service_auto_scaling', 'estimated_monthly_savings': '€50-150'}
-        
-        elif resource_type in ['virtual_machine', 'vm']:
-            if environment == 'development':
-                recommendations.append(f"VM {resource_name}: Use B-Series burstable VMs with auto-shutdown")
-                savings[resource_name] = {'type': 'vm_dev_optimization', 'estimated_monthly_savings': '€100-300'}
-            elif environment == 'staging':
-                recommendations.append(f"VM {resource_name}: Use Standard_D2s_v3 with scheduled shutdown")
-                savings[resource_name] = {'type': 'vm_staging_optimization', 'estimated_monthly_savings': '€50-150'}
-            else:  # production
-                recommendations.append(f"VM {resource_name}: Consider Reserved Instances for 1-3 year terms")
-                savings[resource_name] = {'type': 'vm_reserved_instances', 'estimated_monthly_savings': '€200-600'}
-        
-        elif resource_type in ['sql_database', 'azure_sql']:
-            if environment == 'development':
-                recommendations.append(f"SQL Database {resource_name}: Use Basic tier (€4-15/month)")
-                savings[resource_name] = {'type': 'sql_basic_tier', 'estimated_monthly_savings': '€50-150'}
-            elif environment == 'staging':
-                recommendations.append(f"SQL Database {resource_name}: Use S1 Standard tier (€20/month)")
-                savings[resource_name] = {'type': 'sql_standard_tier', 'estimated_monthly_savings': '€30-100'}
-            else:  # production
-                recommendations.append(f"SQL Database {resource_name}: Consider elastic pools for multiple DBs")
-                savings[resource_name] = {'type': 'sql_elastic_pools', 'estimated_monthly_savings': '€100-400'}
-        
-        elif resource_type in ['storage_account', 'blob_storage']:
-            recommendations.append(f"Storage {resource_name}: Use appropriate access tiers (Hot/Cool/Archive)")
-            savings[resource_name] = {'type': 'storage_tiering', 'estimated_monthly_savings': '€20-100'}
-        
-        elif resource_type in ['kubernetes_service', 'aks']:
-            if environment == 'development':
-                recommendations.append(f"AKS {resource_name}: Use smaller node sizes and auto-scaling")
-                savings[resource_name] = {'type': 'aks_dev_optimization', 'estimated_monthly_savings': '€150-500'}
-            else:
-                recommendations.append(f"AKS {resource_name}: Use spot instances for non-critical workloads")
-                savings[resource_name] = {'type': 'aks_spot_instances', 'estimated_monthly_savings': '€200-800'}
-        
+        rules = RESOURCE_OPTIMIZATION_RULES.get(_RESOURCE_TYPE_ALIASES.get(resource_type, resource_type))
+        if rules:
+            recommendation, savings_type, estimated_savings = rules.get(environment) or rules[None]
+            recommendations.append(recommendation.format_map({'name': resource_name}))
+            savings[resource_name] = {'type': savings_type, 'estimated_monthly_savings': estimated_savings}
         else:
             # Generic optimization for other services
             recommendations.append(f"{resource_type.replace('_', ' ').title()} {resource_name}: Review sizing and enable monitoring")
@@ -486,105 +778,250 @@ class CostOptimizationAgent:
     
     def _generate_ai_optimization_insights(self, architecture_analysis: Dict[str, Any], environment: str, recommendations: List[str]) -> Dict[str, Any]:
         """Generate AI-powered cost optimization insights using OpenAI"""
+        # Too little for the model to build on; use the static insights
+        if len(recommendations) < MIN_RECOMMENDATIONS_FOR_AI_INSIGHTS:
+            return self._fallback_ai_insights()
+        if not self.use_ai:
+            return self._template_insights(architecture_analysis, environment, recommendations)
+        
         try:
-            # Prepare context for AI analysis
-            context = {
-                'environment': environment,
-                'resource_count': len(architecture_analysis.get('components', [])),
-                'current_recommendations': recommendations[:5],  # Limit to first 5 for AI context
-                'architecture_type': architecture_analysis.get('metadata', {}).get('architecture_type', 'Web Application')
-            }
+            # Static instructions first, request-specific context last, so the
+            # provider's automatic prompt caching can reuse the shared prefix
+            prompt = INSIGHTS_INSTRUCTIONS + self._format_insights_context(architecture_analysis, environment, recommendations)
             
-            prompt = f"""
-You are a Microsoft Azure cost optimization expert. Analyze this architecture and provide advanced cost optimization insights.
-
-Architecture Context:
-- Environment: {environment}
-- Resource Count: {context['resource_count']}
-- Architecture Type: {context['architecture_type']}
-- Current Optimizations: {', '.join(recommendations[:3])}
-
-Provide JSON response with:
-1. "strategic_recommendations": 3-5 high-impact cost optimization strategies
-2. "architectural_patterns": Cost-effective architectural patterns to consider
-3. "monitoring_strategy": Cost monitoring and alerting recommendations
-4. "long_term_savings": Long-term cost optimization roadmap
-5. "risk_assessment": Potential risks of proposed optimizations
-
-Focus on Microsoft Well-Architected Framework cost optimization principles.
-Ensure recommendations are specific to {environment} environment.
-"""
+            # Architectures that differ only in fields the prompt ignores reuse earlier insights
+            insights_key = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+            with self._cache_lock:
+                cached_insights = self._ai_insights_cache.get(insights_key)
+                if cached_insights is not None:
+                    self._ai_insights_cache.move_to_end(insights_key)
+            if cached_insights:
+                return cached_insights
 
             response = self.openai_client.chat.completions.create(
                 model=self.model_name,
                 messages=[
-                    {"role": "system", "content": "You are an expert Azure cost optimization consultant following Microsoft Well-Architected Framework principles."},
+                    {"role": "system", "content": INSIGHTS_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
-                temperature=0.3,
-                max_tokens=1500,
-                timeout=300  # 5 minutes timeout for OpenAI API
+                response_format=self.response_format,
+                temperature=0.0,
+                seed=INSIGHTS_SEED,
+                max_tokens=INSIGHTS_MAX_TOKENS,
+                timeout=300,  # 5 minutes timeout for OpenAI API
+                stream=True
             )
             
-            ai_response = response.choices[0].message.content.strip()
+            ai_response = collect_streamed_response(response).strip()
             
             # Try to parse JSON response
-            try:
-                insights = json.loads(ai_response)
-                return insights
-            except json.JSONDecodeError:
+            insights = None
+            json_span = extract_json_span(ai_response)
+            if json_span:
+                try:
+                    insights = json_loads(ai_response[json_span[0]:json_span[1]])
+                except JSONDecodeError:
+                    pass
+            
+            if not isinstance(insights, dict):
                 # Fallback to structured text parsing
-                return {
+                insights = {
                     "strategic_recommendations": self._extract_recommendations_from_text(ai_response),
                     "raw_response": ai_response
                 }
+            
+            self._add_to_ai_insights_cache(insights_key, insights)
+            return insights
                 
         except Exception as e:
             print(f"⚠️ Cost Optimization Agent: AI insights generation failed: {str(e)}")
+            return self._fallback_ai_insights(str(e))
+    
+    def _generate_ai_optimization_insights_multi(self, architecture_analysis: Dict[str, Any], recommendations_by_environment: Dict[str, List[str]]) -> Dict[str, Dict[str, Any]]:
+        """Generate AI insights for several environments with one OpenAI call"""
+        environments = list(recommendations_by_environment)
+        if all(len(recommendations) < MIN_RECOMMENDATIONS_FOR_AI_INSIGHTS for recommendations in recommendations_by_environment.values()):
+            return {environment: self._fallback_ai_insights() for environment in environments}
+        if not self.use_ai:
             return {
-                "strategic_recommendations": [
-                    "Review resource utilization patterns",
-                    "Implement auto-scaling policies",
-                    "Consider reserved capacity for production workloads"
-                ],
-                "error": str(e)
+                environment: self._template_insights(architecture_analysis, environment, recommendations)
+                for environment, recommendations in recommendations_by_environment.items()
             }
+        
+        try:
+            prompt = INSIGHTS_INSTRUCTIONS + (
+                f"\nThe architecture is being optimized for these environments: {', '.join(environments)}. "
+                "Return one JSON object keyed by environment name, each value holding the fields listed above.\n"
+            ) + ''.join(
+                self._format_insights_context(architecture_analysis, environment, recommendations)
+                for environment, recommendations in recommendations_by_environment.items()
+            )
+            
+            response = self.openai_client.chat.completions.create(
+                model=self.model_name,
+                messages=[
+                    {"role": "system", "content": INSIGHTS_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format=self.response_format,
+                temperature=0.0,
+                seed=INSIGHTS_SEED,
+                max_tokens=INSIGHTS_MAX_TOKENS * len(environments),
+                timeout=300  # 5 minutes timeout for OpenAI API
+            )
+            
+            ai_response = response.choices[0].message.content.strip()
+            insights = self._decode_json_object(ai_response)
+            
+            missing = [environment for environment in environments if not isinstance(insights.get(environment), dict)]
+            if missing:
+                raise ValueError(f"No insights returned for {', '.join(missing)}")
+            return {environment: insights[environment] for environment in environments}
+            
+        except Exception as e:
+            print(f"⚠️ Cost Optimization Agent: AI insights generation failed: {str(e)}")
+            return {environment: self._fallback_ai_insights(str(e)) for environment in environments}
+    
+    def _generate_ai_optimization_insights_batch(self, architecture_analyses: List[Dict[str, Any]], environment: str, recommendations_list: List[List[str]]) -> List[Dict[str, Any]]:
+        """Generate AI insights for several architectures with one OpenAI call"""
+        count = len(architecture_analyses)
+        if not self.use_ai:
+            return [
+                self._template_insights(architecture_analysis, environment, recommendations)
+                for architecture_analysis, recommendations in zip(architecture_analyses, recommendations_list)
+            ]
+        
+        try:
+            prompt = INSIGHTS_INSTRUCTIONS + (
+                f"\n{count} architectures follow, numbered 1 to {count}. "
+                "Return one JSON object with an \"architectures\" array holding, in the same order, "
+                "an object with the fields listed above for each architecture.\n"
+            ) + ''.join(
+                f"\n--- Architecture {number} ---" + self._format_insights_context(architecture_analysis, environment, recommendations)
+                for number, (architecture_analysis, recommendations) in enumerate(zip(architecture_analyses, recommendations_list), 1)
+            )
+            
+            response = self.openai_client.chat.completions.create(
+                model=self.model_name,
+                messages=[
+                    {"role": "system", "content": INSIGHTS_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format=self.response_format,
+                temperature=0.0,
+                seed=INSIGHTS_SEED,
+                max_tokens=INSIGHTS_MAX_TOKENS * count,
+                timeout=300  # 5 minutes timeout for OpenAI API
+            )
+            
+            ai_response = response.choices[0].message.content.strip()
+            insights = self._decode_json_object(ai_response).get('architectures')
+            
+            if not isinstance(insights, list) or len(insights) != count or not all(isinstance(item, dict) for item in insights):
+                raise ValueError(f"Expected insights for {count} architectures")
+            return insights
+            
+        except Exception as e:
+            print(f"⚠️ Cost Optimization Agent: AI insights generation failed: {str(e)}")
+            return [self._fallback_ai_insights(str(e)) for _ in range(count)]
+    
+    def _decode_json_object(self, text: str) -> Dict[str, Any]:
+        """Decode a JSON object reply, allowing surrounding prose from models without JSON mode"""
+        try:
+            decoded = json_loads(text)
+        except JSONDecodeError:
+            json_span = extract_json_span(text)
+            if not json_span:
+                raise ValueError("No JSON object in AI response")
+            decoded = json_loads(text[json_span[0]:json_span[1]])
+        if not isinstance(decoded, dict):
+            raise ValueError("AI response is not a JSON object")
+        return decoded
+    
+    def _format_insights_context(self, architecture_analysis: Dict[str, Any], environment: str, recommendations: List[str]) -> str:
+        """Format the request-specific context appended to the insights prompt"""
+        resource_count = len(architecture_analysis.get('components', []))
+        architecture_type = architecture_analysis.get('metadata', {}).get('architecture_type', 'Web Application')
+        return f"""
+## Architecture Context
+- Environment: {environment}
+- Resource Count: {resource_count}
+- Architecture Type: {architecture_type}
+- Current Optimizations: {', '.join(recommendations[:3])}
+"""
+    
+    def _template_insights(self, architecture_analysis: Dict[str, Any], environment: str, recommendations: List[str]) -> Dict[str, Any]:
+        """Build insights with the same fields as the AI response from the framework principles"""
+        principles = self.cost_optimization_framework['principles']
+        principle_names = _TEMPLATE_INSIGHT_PRINCIPLES.get(environment, _TEMPLATE_INSIGHT_PRINCIPLES['production'])
+        selected = [principles[name] for name in principle_names]
+        resource_count = len(architecture_analysis.get('components', []))
+        architecture_type = architecture_analysis.get('metadata', {}).get('architecture_type', 'Web Application')
+        
+        return {
+            "strategic_recommendations": [f"{principle['description']}: {principle['strategies'][0]}" for principle in selected],
+            "architectural_patterns": list(principles['automation']['strategies']),
+            "monitoring_strategy": list(principles['monitoring']['strategies']),
+            "long_term_savings": list(principles['reserved_capacity']['strategies']),
+            "risk_assessment": "Low" if environment == 'development' else "Medium",
+            "executive_narrative": (
+                f"{len(recommendations)} cost optimization recommendations for a {resource_count}-resource "
+                f"{architecture_type} in the {environment} environment, focused on "
+                f"{', '.join(name.replace('_', ' ') for name in principle_names)}."
+            ),
+            "risk_details": list(_TEMPLATE_RISK_DETAILS)
+        }
+    
+    def _fallback_ai_insights(self, error: Optional[str] = None) -> Dict[str, Any]:
+        """Static insights used when the AI call is skipped or fails"""
+        insights = {
+            "strategic_recommendations": [
+                "Review resource utilization patterns",
+                "Implement auto-scaling policies",
+                "Consider reserved capacity for production workloads"
+            ]
+        }
+        if error:
+            insights["error"] = error
+        return insights
+    
+    def _add_to_ai_insights_cache(self, insights_key: str, insights: Dict[str, Any]):
+        """Add AI insights to the prompt-keyed cache"""
+        with self._cache_lock:
+            self._ai_insights_cache[insights_key] = insights
+            self._ai_insights_cache.move_to_end(insights_key)
+            
+            while len(self._ai_insights_cache) > self._max_cache_size:
+                # Remove least recently used entry
+                self._ai_insights_cache.popitem(last=False)
     
     def _extract_recommendations_from_text(self, text: str) -> List[str]:
         """Extract recommendations from AI text response"""
         recommendations = []
-        lines = text.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if (line.startswith('•') or line.startswith('-') or line.startswith('*') or 
-                line.startswith('1.') or line.startswith('2.') or line.startswith('3.')):
-                clean_line = line.lstrip('•-*123456789. ').strip()
-                if clean_line and len(clean_line) > 10:
+        
+        for line in text.split('\n'):
+            match = _BULLET_RE.match(line.strip())
+            if match:
+                clean_line = match.group(1).strip()
+                if len(clean_line) > 10:
                     recommendations.append(clean_line)
+                    if len(recommendations) == 5:  # Limit to 5 recommendations
+                        break
         
-        return recommendations[:5]  # Limit to 5 recommendations
+        return recommendations
     
     def _create_optimization_summary(self, environment: str, recommendations: List[str], cost_savings: List[Dict], ai_insights: Dict[str, Any]) -> Dict[str, Any]:
         """Create comprehensive optimization summary"""
         
-        # Calculate total estimated savings
-        total_savings_low = 0
-        total_savings_high = 0
-        
-        for saving in cost_savings:
-            for resource_name, saving_info in saving.items():
-                if 'estimated_monthly_savings' in saving_info:
-                    savings_str = saving_info['estimated_monthly_savings']
-                    # Extract numbers from strings like "€50-150"
-                    import re
-                    numbers = re.findall(r'\d+', savings_str)
-                    if len(numbers) >= 2:
-                        total_savings_low += int(numbers[0])
-                        total_savings_high += int(numbers[1])
-                    elif len(numbers) == 1:
-                        total_savings_low += int(numbers[0])
-                        total_savings_high += int(numbers[0])
+        # Calculate total estimated savings from strings like "€50-150"
+        ranges = [
+            _parse_savings_range(saving_info['estimated_monthly_savings'])
+            for saving in cost_savings
+            for saving_info in saving.values()
+            if 'estimated_monthly_savings' in saving_info
+        ]
+        total_savings_low = sum(low for low, _ in ranges)
+        total_savings_high = sum(high for _, high in ranges)
         
         return {
             'environment': environment,
@@ -655,21 +1092,59 @@ Ensure recommendations are specific to {environment} environment.
     
     def _get_cache_key(self, architecture_analysis: Dict[str, Any], environment: str) -> str:
         """Generate cache key for optimization results"""
-        content_str = json.dumps(architecture_analysis, sort_keys=True) + environment
-        return hashlib.md5(content_str.encode()).hexdigest()
+        # Hash only the parts the optimization result is built from, one at a time,
+        # so unrelated analysis fields neither bloat the key nor split cache entries
+        hasher = _new_cache_key_hasher()
+        for field in _CACHE_KEY_FIELDS:
+            hasher.update(json_dumps_bytes(architecture_analysis.get(field), sort_keys=True))
+            hasher.update(b'\x1f')
+        hasher.update(environment.encode())
+        if not self.use_ai:
+            hasher.update(b'\x1ftemplate')
+        return hasher.hexdigest()
     
     def _get_from_cache(self, cache_key: str) -> Dict[str, Any]:
-        """Get cached optimization result"""
-        return self._optimization_cache.get(cache_key)
+        """Get cached optimization result (memory first, then disk)"""
+        with self._cache_lock:
+            result = self._optimization_cache.get(cache_key)
+            if result is not None:
+                self._optimization_cache.move_to_end(cache_key)
+        if result is None:
+            result = self._disk_cache.get(cache_key)
+            if result is not None:
+                self._add_to_memory_cache(cache_key, result)
+        return result
     
     def _add_to_cache(self, cache_key: str, result: Dict[str, Any]):
-        """Add optimization result to cache"""
-        if len(self._optimization_cache) >= self._max_cache_size:
-            # Remove oldest entry
-            oldest_key = next(iter(self._optimization_cache))
-            del self._optimization_cache[oldest_key]
+        """Add optimization result to the memory and disk caches"""
+        if 'error' in result.get('ai_insights', {}):
+            # Insights fell back after a failed AI call (e.g. a timeout); let the next call retry
+            return
+        self._add_to_memory_cache(cache_key, result)
+        self._disk_cache.set(cache_key, result)
+    
+    def _add_to_memory_cache(self, cache_key: str, result: Dict[str, Any]):
+        """Add optimization result to the in-process cache"""
+        with self._cache_lock:
+            self._optimization_cache[cache_key] = result
+            self._optimization_cache.move_to_end(cache_key)
+            
+            while len(self._optimization_cache) > self._max_cache_size:
+                # Remove least recently used entry
+                self._optimization_cache.popitem(last=False)
+    
+    def get_executive_narrative(self, optimization_result: Dict[str, Any]) -> str:
+        """Return the executive narrative produced alongside the AI insights (no extra API call)"""
+        narrative = optimization_result.get('ai_insights', {}).get('executive_narrative')
+        if isinstance(narrative, str) and narrative.strip():
+            return narrative.strip()
         
-        self._optimization_cache[cache_key] = result
+        summary = optimization_result.get('optimization_summary', {})
+        return (
+            f"{summary.get('total_recommendations', 0)} cost optimization recommendations for the "
+            f"{summary.get('environment', optimization_result.get('environment', 'target'))} environment, "
+            f"with estimated savings of {summary.get('estimated_monthly_savings', '€0')} per month."
+        )
     
     def generate_cost_optimization_report(self, optimization_result: Dict[str, Any]) -> str:
         """Generate a detailed cost optimization report"""
@@ -677,86 +1152,68 @@ Ensure recommendations are specific to {environment} environment.
         if 'error' in optimization_result:
             return f"# Cost Optimization Report\n\n**Error**: {optimization_result['error']}\n"
         
-        report = []
-        report.append("# Azure Cost Optimization Report")
-        report.append("")
-        
         # Summary
         summary = optimization_result.get('optimization_summary', {})
-        report.append(f"## Executive Summary")
-        report.append(f"**Environment**: {summary.get('environment', 'Unknown')}")
-        report.append(f"**Framework**: {summary.get('optimization_framework', 'Microsoft Well-Architected Framework')}")
-        report.append(f"**Total Recommendations**: {summary.get('total_recommendations', 0)}")
-        report.append(f"**Estimated Monthly Savings**: {summary.get('estimated_monthly_savings', '€0')}")
-        report.append(f"**Estimated Annual Savings**: {summary.get('estimated_annual_savings', '€0')}")
-        report.append(f"**Implementation Priority**: {summary.get('implementation_priority', 'Medium')}")
-        report.append("")
+        report = [
+            "# Azure Cost Optimization Report\n"
+            "\n"
+            "## Executive Summary\n"
+            f"**Environment**: {summary.get('environment', 'Unknown')}\n"
+            f"**Framework**: {summary.get('optimization_framework', 'Microsoft Well-Architected Framework')}\n"
+            f"**Total Recommendations**: {summary.get('total_recommendations', 0)}\n"
+            f"**Estimated Monthly Savings**: {summary.get('estimated_monthly_savings', '€0')}\n"
+            f"**Estimated Annual Savings**: {summary.get('estimated_annual_savings', '€0')}\n"
+            f"**Implementation Priority**: {summary.get('implementation_priority', 'Medium')}\n"
+            "\n"
+        ]
+        narrative = optimization_result.get('ai_insights', {}).get('executive_narrative')
+        if narrative:
+            report.append(f"{self.get_executive_narrative(optimization_result)}\n\n")
         
         # Optimization Recommendations
         recommendations = optimization_result.get('optimization_recommendations', [])
         if recommendations:
-            report.append("## Cost Optimization Recommendations")
-            report.append("")
+            report.append("## Cost Optimization Recommendations\n\n")
             for i, recommendation in enumerate(recommendations[:10], 1):  # Top 10
-                report.append(f"{i}. {recommendation}")
-            report.append("")
+                report.append(f"{i}. {recommendation}\n")
+            report.append("\n")
         
         # AI Insights
         ai_insights = optimization_result.get('ai_insights', {})
         if ai_insights.get('strategic_recommendations'):
-            report.append("## AI-Powered Strategic Insights")
-            report.append("")
+            report.append("## AI-Powered Strategic Insights\n\n")
             for insight in ai_insights['strategic_recommendations'][:5]:
-                report.append(f"• {insight}")
-            report.append("")
+                report.append(f"• {insight}\n")
+            report.append("\n")
         
         # Cost Savings Breakdown
         cost_savings = optimization_result.get('cost_savings', [])
         if cost_savings:
-            report.append("## Estimated Cost Savings Breakdown")
-            report.append("")
+            report.append("## Estimated Cost Savings Breakdown\n\n")
             for saving in cost_savings:
                 for resource_name, saving_info in saving.items():
                     savings_type = saving_info.get('type', 'optimization')
                     estimated_savings = saving_info.get('estimated_monthly_savings', '€0')
-                    report.append(f"• **{resource_name}** ({savings_type}): {estimated_savings}/month")
-            report.append("")
+                    report.append(f"• **{resource_name}** ({savings_type}): {estimated_savings}/month\n")
+            report.append("\n")
         
         # Key Optimization Areas
         key_areas = summary.get('key_optimization_areas', [])
         if key_areas:
-            report.append("## Key Optimization Areas")
-            report.append("")
+            report.append("## Key Optimization Areas\n\n")
             for area in key_areas:
-                report.append(f"• {area}")
-            report.append("")
+                report.append(f"• {area}\n")
+            report.append("\n")
         
         # Next Steps
         next_steps = summary.get('next_steps', [])
         if next_steps:
-            report.append("## Implementation Next Steps")
-            report.append("")
+            report.append("## Implementation Next Steps\n\n")
             for i, step in enumerate(next_steps, 1):
-                report.append(f"{i}. {step}")
-            report.append("")
-        
-        # Framework Compliance
-        report.append("## Microsoft Well-Architected Framework Compliance")
-        report.append("")
-        report.append("This optimization follows the five key principles of cost optimization:")
-        report.append("• **Plan and estimate costs** - Detailed cost analysis and estimation")
-        report.append("• **Provision with optimization** - Right-sized resources for environment")
-        report.append("• **Use monitoring and analytics** - Recommendations for cost monitoring")
-        report.append("• **Maximize efficiency** - Auto-scaling and automation recommendations")
-        report.append("• **Optimize over time** - Continuous optimization roadmap")
-        report.append("")
-        
-        # Disclaimers
-        report.append("## Important Notes")
-        report.append("")
-        report.append("• Cost savings estimates are approximate and may vary based on actual usage")
-        report.append("• Implement changes in non-production environments first")
-        report.append("• Monitor performance impact after implementing optimizations")
-        report.append("• Review and update optimizations regularly as usage patterns change")
-        
-        return "\n".join(report)
+                report.append(f"{i}. {step}\n")
+            report.append("\n")
+        
+        # Framework compliance and disclaimers never change
+        report.append(_REPORT_FOOTER)
+        
+        return ''.join(report)
@@ -12,6 +12,11 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# First letters a service pattern match can start with ('a' also covers the optional
+# "azure" prefix); lets the combined service regex skip other positions quickly.
+# Extend when adding a pattern for a service starting with another letter
+_SERVICE_FIRST_LETTERS = 'abcfklmnpsv'
+
 
 class FastArchitectureAnalyzer:
     """
@@ -59,6 +64,7 @@ class FastArchitectureAnalyzer:
 
         # Pre-compiled patterns for instant matching
         self._service_patterns = self._compile_service_patterns()
+        self._service_regex, self._service_groups = self._combine_service_patterns(self._service_patterns)
         self._region_patterns = self._compile_region_patterns()
 
         timeout_msg = f"⚡ Fast Architecture Analyzer initialized "
@@ -109,6 +115,23 @@ class FastArchitectureAnalyzer:
         
         return patterns
     
+    def _combine_service_patterns(self, service_patterns):
+        """Fuse all service patterns into one regex so detection scans the content once"""
+        alternatives = []
+        service_groups = {}  # group name -> (category, resource_type, index of the pattern's first own group)
+        group_index = 1
+        for category, patterns in service_patterns.items():
+            for pattern, resource_type in patterns:
+                name = f"service{len(service_groups)}"
+                alternatives.append(f"(?P<{name}>{pattern.pattern})")
+                service_groups[name] = (category, resource_type, group_index + 1)
+                group_index += 1 + pattern.groups
+        
+        # Inside a lookahead every position is tried, so overlapping mentions are
+        # still found, just as with one scan per pattern
+        combined = re.compile(f"(?=[{_SERVICE_FIRST_LETTERS}])(?=" + '|'.join(alternatives) + ')', re.IGNORECASE)
+        return combined, service_groups
+    
     def _compile_region_patterns(self):
         """Pre-compile Azure region patterns"""
         return [
@@ -177,22 +200,28 @@ class FastArchitectureAnalyzer:
         detected = []
         seen_services = set()
         
-        # Quick text processing
-        content_lower = content.lower()
+        # Single pass: remember the first match of each pattern
+        first_matches = {}
+        for match in self._service_regex.finditer(content):
+            name = match.lastgroup
+            if name not in first_matches:
+                first_matches[name] = match
+                if len(first_matches) == len(self._service_groups):
+                    break
         
-        for category, patterns in self._service_patterns.items():
-            for pattern, resource_type in patterns:
-                matches = pattern.findall(content)
-                if matches and resource_type not in seen_services:
-                    service_name = resource_type.split('/')[-1]
-                    detected.append({
-                        "name": service_name.replace('_', ' ').title(),
-                        "type": resource_type,
-                        "category": category,
-                        "confidence": 0.9,
-                        "detected_text": matches[0] if isinstance(matches[0], str) else matches[0][0]
-                    })
-                    seen_services.add(resource_type)
+        # Report in pattern order, as the per-pattern scans did
+        for name, (category, resource_type, text_group) in self._service_groups.items():
+            match = first_matches.get(name)
+            if match and resource_type not in seen_services:
+                service_name = resource_type.split('/')[-1]
+                detected.append({
+                    "name": service_name.replace('_', ' ').title(),
+                    "type": resource_type,
+                    "category": category,
+                    "confidence": 0.9,
+                    "detected_text": match.group(text_group) or ''
+                })
+                seen_services.add(resource_type)
         
         # Add default services if none detected
         if not detected:
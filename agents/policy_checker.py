@@ -5,8 +5,10 @@ Checks the analyzed architecture against Microsoft Azure policies for compliance
 
 import json
 import os
+import re
 from typing import Dict, List, Any, Optional
 import hashlib
+from utils.fast_json import json_dumps_bytes
 
 try:
     from openai import OpenAI
@@ -20,6 +22,9 @@ try:
 except ImportError:
     print("⚠️ python-dotenv package not installed. Install with: pip install python-dotenv")
 
+# Compiled once; used to pull the JSON object out of model responses
+_JSON_SPAN_RE = re.compile(r'\{.*\}', re.DOTALL)
+
 class PolicyChecker:
     def __init__(self):
         # Check if Azure AI Foundry configuration is available
@@ -559,8 +564,7 @@ class PolicyChecker:
         """Parse the compliance response"""
         try:
             # Try to extract JSON from the response
-            import re
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
+            json_match = _JSON_SPAN_RE.search(response)
             if json_match:
                 compliance_data = json.loads(json_match.group())
                 compliance_data['environment'] = environment
@@ -748,8 +752,11 @@ The following organization-specific Azure policies are available for evaluation:
     
     def _get_cache_key(self, architecture_analysis, environment):
         """Generate cache key from analysis and environment"""
-        key_data = f"{str(architecture_analysis)}{environment}"
-        return hashlib.md5(key_data.encode()).hexdigest()
+        # Sorted-key JSON bytes, so analyses that only differ in key order share an entry
+        hasher = hashlib.blake2b(json_dumps_bytes(architecture_analysis, sort_keys=True), digest_size=16)
+        hasher.update(b'\x1f')
+        hasher.update(environment.encode())
+        return hasher.hexdigest()
     
     def _get_from_cache(self, cache_key):
         """Get cached result if available"""
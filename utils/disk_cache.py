@@ -0,0 +1,105 @@
+"""
+Disk-backed LRU cache
+Persists agent results in SQLite so warm entries survive process restarts
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from utils.fast_json import json_dumps, json_loads, JSONDecodeError
+
+
+class DiskLRUCache:
+    """Small SQLite key/value store with least-recently-used eviction and expiry"""
+
+    def __init__(self, path: str, max_entries: int = 500, expire_seconds: Optional[int] = 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.expire_seconds = expire_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_used ON cache(last_used)")
+            self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Disk cache disabled ({path}): {str(e)}")
+            self._conn = None
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for key, or None on a miss"""
+        if self._conn is None:
+            return None
+
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT value, created FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+
+                value, created = row
+                if self.expire_seconds is not None and now - created > self.expire_seconds:
+                    self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                    return None
+
+                # Promote on hit so eviction follows recency
+                self._conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Disk cache read failed: {str(e)}")
+                return None
+
+        try:
+            return json_loads(value)
+        except JSONDecodeError:
+            return None
+
+    def set(self, key: str, value: Any):
+        """Store value under key, evicting the least recently used entries past max_entries"""
+        if self._conn is None:
+            return
+
+        try:
+            payload = json_dumps(value)
+        except (TypeError, ValueError) as e:
+            print(f"⚠️ Disk cache skipped unserializable value: {str(e)}")
+            return
+
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                    (key, payload, now, now)
+                )
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN ("
+                    "SELECT key FROM cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Disk cache write failed: {str(e)}")
+
+    def clear(self):
+        """Remove all cached entries"""
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
@@ -0,0 +1,143 @@
+"""
+Fast JSON helpers
+Uses orjson when it is installed and falls back to the standard library json module
+"""
+import json
+import re
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+if ORJSON_AVAILABLE:
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, catching either works
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def json_loads(data):
+        """Decode a JSON str/bytes payload"""
+        return orjson.loads(data)
+
+    def json_dumps(obj, indent: bool = False, sort_keys: bool = False) -> str:
+        """Encode obj to a JSON string (2-space indent when indent=True)"""
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=str, option=option).decode()
+
+    def json_dumps_bytes(obj, sort_keys: bool = False) -> bytes:
+        """Encode obj to compact UTF-8 JSON bytes, e.g. for hashing"""
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=str, option=option)
+else:
+    JSONDecodeError = json.JSONDecodeError
+
+    def json_loads(data):
+        """Decode a JSON str/bytes payload"""
+        return json.loads(data)
+
+    def json_dumps(obj, indent: bool = False, sort_keys: bool = False) -> str:
+        """Encode obj to a JSON string (2-space indent when indent=True)"""
+        return json.dumps(obj, indent=2 if indent else None, sort_keys=sort_keys, default=str)
+
+    def json_dumps_bytes(obj, sort_keys: bool = False) -> bytes:
+        """Encode obj to compact UTF-8 JSON bytes, e.g. for hashing"""
+        return json.dumps(obj, separators=(',', ':'), sort_keys=sort_keys, default=str).encode()
+
+
+# Characters that matter when scanning for a JSON object; everything else is skipped in C
+_JSON_STRUCTURE_CHARS = re.compile(r'[{}"\\]')
+
+
+class JSONObjectScanner:
+    """
+    Incremental scanner that finds the first balanced top-level JSON object in a
+    stream of text chunks. Tracks brace depth and string/escape state in a single
+    forward pass; start/end are absolute offsets into the concatenated input.
+    """
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self._offset = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped_pos = -1  # absolute index of the character consumed by the last backslash
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, chunk: str) -> bool:
+        """Scan the next chunk; returns True once the object has closed"""
+        if self.end is not None:
+            return True
+
+        base = self._offset
+        self._offset += len(chunk)
+        scan_from = 0
+        if self.start is None:
+            scan_from = chunk.find('{')
+            if scan_from == -1:
+                return False
+            self.start = base + scan_from
+
+        for match in _JSON_STRUCTURE_CHARS.finditer(chunk, scan_from):
+            char = match.group()
+            position = base + match.start()
+            if self._in_string:
+                if position == self._escaped_pos:
+                    continue
+                if char == '\\':
+                    self._escaped_pos = position + 1
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = position + 1
+                    return True
+        return False
+
+
+def collect_streamed_response(stream) -> str:
+    """
+    Accumulate a streamed chat completion, scanning for the JSON object as chunks arrive.
+    Stops reading (and closes the stream) as soon as the top-level object closes.
+    """
+    parts = []
+    scanner = JSONObjectScanner()
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            if scanner.feed(delta):
+                break
+    finally:
+        stream.close()
+
+    return ''.join(parts)
+
+
+def extract_json_span(text: str):
+    """Return (start, end) of the first balanced top-level JSON object in text, or None"""
+    scanner = JSONObjectScanner()
+    if scanner.feed(text):
+        return scanner.start, scanner.end
+    return None
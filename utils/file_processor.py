@@ -48,9 +48,9 @@ class FileProcessor:
         """Generate cache key based on file path and modification time"""
         try:
             stat = os.stat(filepath)
-            return hashlib.md5(f"{filepath}{stat.st_mtime}{stat.st_size}".encode()).hexdigest()
+            return hashlib.blake2b(f"{filepath}{stat.st_mtime}{stat.st_size}".encode(), digest_size=16).hexdigest()
         except OSError:
-            return hashlib.md5(f"{filepath}{time.time()}".encode()).hexdigest()
+            return hashlib.blake2b(f"{filepath}{time.time()}".encode(), digest_size=16).hexdigest()
     
     def _get_from_cache(self, cache_key):
         """Get cached file content"""
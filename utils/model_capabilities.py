@@ -0,0 +1,33 @@
+"""
+Model capability checks
+Decides which response_format options a model or deployment name accepts
+"""
+
+# Model families that accept response_format={"type": "json_schema", ...} (structured outputs)
+_JSON_SCHEMA_PREFIXES = ('gpt-4o', 'gpt-4.1', 'gpt-4.5', 'gpt-5', 'o1', 'o3', 'o4')
+
+# Additional model families that only accept response_format={"type": "json_object"}
+_JSON_OBJECT_PREFIXES = ('gpt-4o-2024-05-13', 'gpt-4-turbo', 'gpt-4-1106', 'gpt-4-0125', 'gpt-3.5-turbo', 'gpt-35-turbo')
+
+# Early reasoning models take no response_format at all
+_NO_RESPONSE_FORMAT_PREFIXES = ('o1-preview', 'o1-mini')
+
+
+def _normalize(model_name) -> str:
+    return (model_name or '').strip().lower()
+
+
+def supports_json_object(model_name) -> bool:
+    """True when the model accepts JSON mode; plain gpt-4 rejects it with a 400"""
+    name = _normalize(model_name)
+    if name.startswith(_NO_RESPONSE_FORMAT_PREFIXES):
+        return False
+    return name.startswith(_JSON_SCHEMA_PREFIXES + _JSON_OBJECT_PREFIXES)
+
+
+def supports_json_schema(model_name) -> bool:
+    """True when the model (or an Azure deployment named after it) accepts json_schema structured output"""
+    name = _normalize(model_name)
+    if name.startswith(_NO_RESPONSE_FORMAT_PREFIXES + _JSON_OBJECT_PREFIXES):
+        return False
+    return name.startswith(_JSON_SCHEMA_PREFIXES)